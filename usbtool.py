@@ -13,232 +13,814 @@ import argparse
 import sys
 import os
 import json
+import itertools
+import shutil
+import multiprocessing
+import random
+import urllib.parse
 import urllib.request
 import platform
 import base64
+import gzip
+import hashlib
+import heapq
 import io
+import struct
+import asyncio
+import email.parser
+import email.utils
+import http.client
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime, timedelta
-from queue import Queue
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import socketserver
-from PIL import Image, ImageGrab
-import pyautogui
+from http import HTTPStatus
 
-class WebDisplayHandler(BaseHTTPRequestHandler):
-    """HTTP handler for web-based app display"""
+# Imaging, input and compression libraries are imported by load_dependencies()
+# on first use, so control-socket actions (--action status) start instantly
+Image = ImageChops = ImageDraw = ImageGrab = None
+pyautogui = None
+np = None
+brotli = None
+_dependencies_loaded = False
+
+def load_dependencies():
+    """Import PIL and the optional pyautogui, numpy and brotli modules (once)"""
+    global Image, ImageChops, ImageDraw, ImageGrab, pyautogui, np, brotli, _dependencies_loaded
+    if _dependencies_loaded:
+        return
     
-    def do_GET(self):
-        """Handle GET requests"""
-        path = self.path.split('?')[0]
-        
-        if path == '/':
-            self.serve_app_interface()
-        elif path == '/app-screen':
-            self.serve_app_screenshot()
-        elif path == '/api/screenshot':
-            self.serve_screenshot_api()
-        elif path == '/api/click':
-            self.handle_click()
-        elif path == '/api/status':
-            self.serve_status_api()
-        elif path.startswith('/static/'):
-            self.serve_static_content(path)
-        else:
-            self.send_error(404)
+    from PIL import Image, ImageChops, ImageDraw, ImageGrab
     
-    def do_POST(self):
-        """Handle POST requests"""
-        path = self.path.split('?')[0]
+    try:
+        import pyautogui
+    except Exception:  # Not installed, or no display to attach to (headless hosts)
+        pyautogui = None
+    
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    
+    _dependencies_loaded = True
+
+VERSION = '1.0'
+UPLOAD_DIR = os.path.join(os.path.expanduser('~'), '.usbtool', 'uploads')
+CONTROL_SOCKET = os.path.join(os.path.expanduser('~'), '.usbtool', 'station.sock')
+
+class Metric:
+    """A Prometheus counter, gauge or histogram, optionally labelled"""
+    
+    def __init__(self, name, help_text, kind, buckets=None, callback=None):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.buckets = buckets
+        self.callback = callback
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def label_key(labels):
+        return tuple(sorted(labels.items()))
+    
+    def inc(self, amount=1, **labels):
+        """Increase a counter or gauge"""
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def set(self, value, **labels):
+        """Set a gauge"""
+        with self.lock:
+            self.values[self.label_key(labels)] = value
+    
+    def observe(self, value, **labels):
+        """Record one histogram observation"""
+        key = self.label_key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+    
+    @staticmethod
+    def format_labels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+    
+    def render(self):
+        """Lines of the text exposition format for this metric"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
         
-        if path == '/api/click':
-            self.handle_click()
-        elif path == '/api/key':
-            self.handle_key()
-        elif path == '/api/upload':
-            self.handle_upload()
-        else:
-            self.send_error(404)
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception:
+                value = None
+            if value is not None:
+                lines.append(f"{self.name} {value}")
+            return lines
+        
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            if self.kind != 'histogram':
+                lines.append(f"{self.name}{self.format_labels(key)} {value}")
+                continue
+            counts, total, count = value
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', bound)])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Process-wide collection of metrics served on /metrics"""
+    
+    LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    SIZE_BUCKETS = (10000, 25000, 50000, 100000, 200000, 400000, 800000, 1600000)
+    DURATION_BUCKETS = (1, 10, 60, 300, 900, 1800, 3600, 14400)
+    
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def register(self, name, help_text, kind, buckets=None, callback=None):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric(name, help_text, kind, buckets, callback)
+            elif callback is not None:
+                metric.callback = callback  # Latest owner (e.g. a restarted server) wins
+            return metric
+    
+    def counter(self, name, help_text):
+        return self.register(name, help_text, 'counter')
+    
+    def gauge(self, name, help_text, callback=None):
+        return self.register(name, help_text, 'gauge', callback=callback)
+    
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self.register(name, help_text, 'histogram', buckets=buckets)
+    
+    def render(self):
+        """The whole registry in Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+METRICS = MetricsRegistry()
+FRAME_STAGE_SECONDS = METRICS.histogram(
+    'usbtool_frame_stage_seconds', 'Time spent in each frame pipeline stage')
+FRAME_BYTES = METRICS.histogram(
+    'usbtool_frame_bytes', 'Encoded size of published full frames', MetricsRegistry.SIZE_BUCKETS)
+FRAMES_TOTAL = METRICS.counter(
+    'usbtool_frames_total', 'Captured frames by outcome')
+INPUT_SECONDS = METRICS.histogram(
+    'usbtool_input_injection_seconds', 'Latency of injecting clicks and keys')
+VIRTUALHERE_COMMAND_SECONDS = METRICS.histogram(
+    'usbtool_virtualhere_command_seconds', 'VirtualHere command round-trip time')
+DEVICE_POLL_SECONDS = METRICS.histogram(
+    'usbtool_device_poll_seconds', 'Duration of one device list poll')
+STARTUP_STAGE_SECONDS = METRICS.gauge(
+    'usbtool_startup_stage_seconds', 'Time each startup stage took to become ready')
+SESSIONS_STARTED = METRICS.counter(
+    'usbtool_sessions_started_total', 'Device sessions started')
+HTTP_REQUEST_SECONDS = METRICS.histogram(
+    'usbtool_http_request_seconds', 'HTTP request handling time by route and status')
+HTTP_STREAM_SECONDS = METRICS.histogram(
+    'usbtool_http_stream_seconds', 'How long streaming connections stayed open, by route',
+    MetricsRegistry.DURATION_BUCKETS)
+
+# Web UI assets, built and compressed once per server by StaticAssets
+APP_CSS = '''
+* {
+    margin: 0;
+    padding: 0;
+    box-sizing: border-box;
+}
+
+body {
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+    background: #1a1a1a;
+    color: white;
+    overflow: hidden;
+}
+
+.container {
+    display: flex;
+    flex-direction: column;
+    height: 100vh;
+}
+
+.header {
+    background: rgba(0, 0, 0, 0.8);
+    padding: 10px 20px;
+    border-bottom: 1px solid #333;
+    display: flex;
+    justify-content: space-between;
+    align-items: center;
+    z-index: 1000;
+}
+
+.title {
+    font-size: 1.2rem;
+    font-weight: 600;
+}
+
+.status {
+    display: flex;
+    gap: 20px;
+    align-items: center;
+    font-size: 0.9rem;
+}
+
+.status-item {
+    display: flex;
+    align-items: center;
+    gap: 5px;
+}
+
+.status-dot {
+    width: 8px;
+    height: 8px;
+    border-radius: 50%;
+    background: #666;
+}
+
+.status-dot.connected {
+    background: #4ade80;
+    animation: pulse 2s infinite;
+}
+
+.status-dot.waiting {
+    background: #fbbf24;
+}
+
+@keyframes pulse {
+    0%, 100% { opacity: 1; }
+    50% { opacity: 0.5; }
+}
+
+.app-display {
+    flex: 1;
+    position: relative;
+    background: #000;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    overflow: hidden;
+}
+
+.app-screen {
+    max-width: 100%;
+    max-height: 100%;
+    cursor: pointer;
+    border-radius: 8px;
+    box-shadow: 0 4px 20px rgba(0, 0, 0, 0.5);
+    transition: transform 0.1s ease;
+}
+
+.app-screen:active {
+    transform: scale(0.99);
+}
+
+.loading {
+    position: absolute;
+    top: 50%;
+    left: 50%;
+    transform: translate(-50%, -50%);
+    text-align: center;
+}
+
+.spinner {
+    width: 40px;
+    height: 40px;
+    border: 4px solid #333;
+    border-top: 4px solid #4ade80;
+    border-radius: 50%;
+    animation: spin 1s linear infinite;
+    margin: 0 auto 20px;
+}
+
+@keyframes spin {
+    0% { transform: rotate(0deg); }
+    100% { transform: rotate(360deg); }
+}
+
+.controls {
+    position: absolute;
+    bottom: 20px;
+    right: 20px;
+    display: flex;
+    gap: 10px;
+    z-index: 1000;
+}
+
+.control-btn {
+    background: rgba(0, 0, 0, 0.8);
+    border: 1px solid #333;
+    color: white;
+    padding: 8px 12px;
+    border-radius: 6px;
+    cursor: pointer;
+    font-size: 0.9rem;
+    transition: all 0.2s ease;
+}
+
+.control-btn:hover {
+    background: rgba(255, 255, 255, 0.1);
+    border-color: #666;
+}
+
+.fullscreen-btn {
+    position: absolute;
+    top: 20px;
+    right: 20px;
+    background: rgba(0, 0, 0, 0.6);
+    border: none;
+    color: white;
+    padding: 8px;
+    border-radius: 4px;
+    cursor: pointer;
+    z-index: 1000;
+}
+
+.connection-overlay {
+    position: absolute;
+    top: 0;
+    left: 0;
+    right: 0;
+    bottom: 0;
+    background: rgba(0, 0, 0, 0.9);
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    flex-direction: column;
+    z-index: 500;
+}
+
+.hidden {
+    display: none;
+}
+'''
+
+APP_JS = '''
+let screenImg = document.getElementById('appScreen');
+let screenCanvas = document.getElementById('appCanvas');
+let loadingScreen = document.getElementById('loadingScreen');
+let connectionOverlay = document.getElementById('connectionOverlay');
+let isLoaded = false;
+let updateInterval;
+let streaming = false;
+// Kept per tab, so a reload is still the same client and keeps its claim
+const clientId = sessionStorage.getItem('clientId') || Math.random().toString(36).slice(2);
+sessionStorage.setItem('clientId', clientId);
+let screenEtag = null;
+let screenUrl = null;
+
+// ?mode=delta paints only changed tiles onto a canvas
+const deltaMode = new URLSearchParams(location.search).get('mode') === 'delta';
+const screenEl = deltaMode ? screenCanvas : screenImg;
+let deltaRunning = false;
+let deltaGeneration = 0;
+let deltaSeq = 0;
+let clickCooldown = false;
+let inputSocket = null;
+let inputSeq = 0;
+let inputBackoff = 500;
+
+// Initialize
+function init() {
+    startScreenUpdates();
+    startStatusUpdates();
+    setupClickHandler();
+    setupKeyboardHandler();
+    connectInputChannel();
+}
+
+function startScreenUpdates() {
+    if (deltaMode) {
+        startDeltaUpdates();
+        return;
+    }
+
+    // One long-lived MJPEG stream; the server pushes every new frame
+    streaming = true;
+    screenImg.onload = onScreenLoaded;
+    screenImg.onerror = function() {
+        if (!streaming) return;
+        // Stream unavailable - fall back to polling snapshots
+        streaming = false;
+        onScreenError();
+        startPolling();
+    };
+    screenImg.src = '/api/stream?' + Date.now();
+}
+
+function stopScreenUpdates() {
+    deltaRunning = false;
+    deltaGeneration++;
+    streaming = false;
+    clearInterval(updateInterval);
+    screenImg.removeAttribute('src'); // Closes the stream connection
+}
+
+function startDeltaUpdates() {
+    deltaRunning = true;
+    const generation = ++deltaGeneration;
+    const ctx = screenCanvas.getContext('2d');
+
+    function next() {
+        if (!deltaRunning || generation !== deltaGeneration) return;
+        fetch('/api/delta?since=' + deltaSeq)
+            .then(response => {
+                if (!response.ok) throw new Error('HTTP ' + response.status);
+                return response.status === 204 ? null : response.json();
+            })
+            .then(delta => delta ? paintDelta(ctx, delta) : null)
+            .then(next)
+            .catch(error => {
+                console.error('Delta error:', error);
+                onScreenError();
+                setTimeout(next, 1000);
+            });
+    }
+    next();
+}
+
+function paintDelta(ctx, delta) {
+    if (screenCanvas.width !== delta.width || screenCanvas.height !== delta.height) {
+        screenCanvas.width = delta.width;
+        screenCanvas.height = delta.height;
+    }
+
+    return Promise.all(delta.tiles.map(tile => new Promise((resolve, reject) => {
+        const img = new Image();
+        img.onload = function() {
+            ctx.drawImage(img, tile[0], tile[1]);
+            resolve();
+        };
+        img.onerror = reject;
+        img.src = 'data:image/jpeg;base64,' + tile[2];
+    }))).then(() => {
+        // Only advance once every tile is painted, so a failure is re-sent
+        deltaSeq = delta.seq;
+        onScreenLoaded();
+    });
+}
+
+function startPolling() {
+    clearInterval(updateInterval);
+    updateInterval = setInterval(updateScreen, 500); // 2 FPS for responsiveness
+    updateScreen(); // Initial load
+}
+
+function onScreenLoaded() {
+    if (!isLoaded) {
+        isLoaded = true;
+        loadingScreen.classList.add('hidden');
+        screenEl.classList.remove('hidden');
+    }
+    document.getElementById('appStatus').classList.add('connected');
+    document.getElementById('appText').textContent = 'App: Connected';
+}
+
+function onScreenError() {
+    if (isLoaded) {
+        document.getElementById('appStatus').classList.remove('connected');
+        document.getElementById('appText').textContent = 'App: Disconnected';
+    }
+}
+
+let screenInFlight = false;
+let lastReceive = '';
+
+function updateScreen() {
+    if (screenInFlight) return;
+    screenInFlight = true;
+
+    // Revalidate with If-None-Match: an unchanged screen is a bodyless 304.
+    // Reporting how long the last frame took lets the server pick the next size.
+    fetch('/api/screenshot?client=' + clientId + lastReceive, {cache: 'no-cache'})
+        .then(response => {
+            if (!response.ok) throw new Error('HTTP ' + response.status);
+            lastReceive = '';
+            const etag = response.headers.get('ETag');
+            if (etag && etag === screenEtag) {
+                onScreenLoaded();
+                return;
+            }
+            screenEtag = etag;
+            const started = performance.now();
+            return response.blob().then(blob => {
+                lastReceive = `&rx_bytes=${blob.size}&rx_ms=${Math.round(performance.now() - started)}`;
+                const previousUrl = screenUrl;
+                screenUrl = URL.createObjectURL(blob);
+                screenImg.onload = function() {
+                    if (previousUrl) URL.revokeObjectURL(previousUrl);
+                    onScreenLoaded();
+                };
+                screenImg.src = screenUrl;
+            });
+        })
+        .catch(onScreenError)
+        .finally(() => { screenInFlight = false; });
+}
+
+function startStatusUpdates() {
+    // The server pushes a snapshot whenever status changes; poll only without EventSource
+    if (window.EventSource) {
+        const events = new EventSource('/api/events?client=' + clientId);
+        events.addEventListener('status', e => applyStatus(JSON.parse(e.data)));
+    } else {
+        setInterval(updateStatus, 2000);
+        updateStatus();
+    }
+}
+
+function updateStatus() {
+    fetch('/api/status')
+        .then(response => response.json())
+        .then(applyStatus)
+        .catch(error => {
+            console.error('Status update error:', error);
+        });
+}
+
+function applyStatus(data) {
+    updateUSBStatus(data.usb);
+    updateSessionInfo(data.session);
+    updateSessionControl(data.sessions || []);
+
+    if (data.usb.connected) {
+        connectionOverlay.classList.add('hidden');
+    } else {
+        connectionOverlay.classList.remove('hidden');
+    }
+}
+
+function updateUSBStatus(usb) {
+    const statusDot = document.getElementById('usbStatus');
+    const statusText = document.getElementById('usbText');
+
+    if (usb.connected) {
+        statusDot.classList.add('connected');
+        statusText.textContent = `USB: ${usb.device_name}`;
+    } else if (usb.queue > 0) {
+        statusDot.classList.add('waiting');
+        statusDot.classList.remove('connected');
+        statusText.textContent = `USB: Queue (${usb.queue})`;
+    } else {
+        statusDot.classList.remove('connected', 'waiting');
+        statusText.textContent = 'USB: Waiting...';
+    }
+}
+
+function updateSessionInfo(session) {
+    const sessionInfo = document.getElementById('sessionInfo');
+    if (session.active) {
+        const remaining = Math.max(0, session.remaining);
+        sessionInfo.textContent = `Session: ${remaining}s remaining`;
+    } else {
+        sessionInfo.textContent = 'Session: --';
+    }
+}
+
+let claimableSession = null;
+let mySession = null;
+
+function updateSessionControl(sessions) {
+    const claimBtn = document.getElementById('claimBtn');
+    const mine = sessions.find(s => s.controller === clientId);
+    mySession = mine || null;
+    claimableSession = mine ? null : sessions.find(s => !s.controller);
+
+    if (mine) {
+        claimBtn.textContent = `🎮 Release ${mine.device}`;
+        document.getElementById('sessionInfo').textContent = `Session: ${mine.remaining}s remaining`;
+    } else if (claimableSession) {
+        claimBtn.textContent = `🎮 Take Control of ${claimableSession.device}`;
+    }
+    claimBtn.classList.toggle('hidden', !mine && !claimableSession);
+}
+
+function claimSession() {
+    // The same button takes control and gives it back
+    const session = mySession || claimableSession;
+    if (!session) return;
+    fetch(mySession ? '/api/session/release' : '/api/session/claim', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({session: session.id, client: clientId})
+    }).then(updateStatus);
+}
+
+// Builds go up in slices; a failed slice resumes from the offset the server reports
+const UPLOAD_SLICE = 8 * 1024 * 1024;
+
+async function uploadBuild(file) {
+    if (!file) return;
+    const button = document.getElementById('uploadBtn');
+    const uploadId = `${clientId}-${file.size}-${file.lastModified}`;
+    const base = `/api/upload?upload=${encodeURIComponent(uploadId)}`;
+    
+    // Ask whether the station already has this exact build (Web Crypto needs https or localhost)
+    if (window.crypto && crypto.subtle && file.size <= 1024 * 1024 * 1024) {
+        button.textContent = '📦 Checking build...';
+        const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        const hash = Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+        const lookup = await fetch(`/api/builds/${hash}`);
+        if (lookup.ok) {
+            button.textContent = `✅ ${file.name} already on station`;
+            return lookup.json();
+        }
+    }
+    
+    let offset = (await (await fetch(base)).json()).offset || 0;
+    let failures = 0;
     
-    def serve_app_interface(self):
-        """Serve the main web interface"""
-        html = '''
+    while (true) {
+        const end = Math.min(offset + UPLOAD_SLICE, file.size);
+        button.textContent = `📦 Uploading ${Math.floor(100 * offset / Math.max(file.size, 1))}%`;
+        try {
+            const response = await fetch(
+                `${base}&name=${encodeURIComponent(file.name)}&offset=${offset}&total=${file.size}`,
+                {method: 'POST', headers: {'Content-Type': 'application/octet-stream'},
+                 body: file.slice(offset, end)});
+            const result = await response.json();
+            if (result.complete) {
+                button.textContent = `✅ ${file.name} uploaded`;
+                return result;
+            }
+            // Out of space (507) keeps the offset but is no progress: back off
+            if (result.offset === undefined || response.status === 507) throw new Error(result.error);
+            offset = result.offset;
+            failures = 0;
+        } catch (error) {
+            if (++failures > 5) {
+                button.textContent = '❌ Upload failed';
+                return null;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            offset = (await (await fetch(base)).json()).offset || 0;
+        }
+    }
+}
+
+function setupClickHandler() {
+    screenEl.addEventListener('click', function(e) {
+        if (clickCooldown) return;
+        clickCooldown = true;
+        setTimeout(() => clickCooldown = false, 200);
+
+        const rect = screenEl.getBoundingClientRect();
+        const frameWidth = deltaMode ? screenCanvas.width : screenImg.naturalWidth;
+        const frameHeight = deltaMode ? screenCanvas.height : screenImg.naturalHeight;
+        const scaleX = frameWidth / rect.width;
+        const scaleY = frameHeight / rect.height;
+
+        const x = Math.round((e.clientX - rect.left) * scaleX);
+        const y = Math.round((e.clientY - rect.top) * scaleY);
+
+        // Visual feedback
+        screenEl.style.filter = 'brightness(1.2)';
+        setTimeout(() => screenEl.style.filter = '', 100);
+
+        // Send click to server
+        sendInput('click', {x: x, y: y, width: frameWidth, height: frameHeight});
+    });
+}
+
+function setupKeyboardHandler() {
+    document.addEventListener('keydown', function(e) {
+        // Don't capture system shortcuts
+        if (e.metaKey || e.ctrlKey || e.altKey) return;
+
+        e.preventDefault();
+
+        sendInput('key', {
+            key: e.key,
+            code: e.code,
+            shift: e.shiftKey
+        });
+    });
+}
+
+function connectInputChannel() {
+    // One ordered WebSocket for all clicks and keys
+    const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const ws = new WebSocket(protocol + '//' + location.host + '/api/ws?client=' + clientId);
+    inputSocket = ws;
+
+    ws.onopen = function() {
+        inputBackoff = 500;
+    };
+    ws.onmessage = function(msg) {
+        const data = JSON.parse(msg.data);
+        if (data.errors && data.errors.length) {
+            console.error('Input errors:', data.errors);
+        }
+    };
+    ws.onclose = function() {
+        if (inputSocket !== ws) return;
+        inputSocket = null;
+        setTimeout(connectInputChannel, inputBackoff);
+        inputBackoff = Math.min(inputBackoff * 2, 10000);
+    };
+}
+
+function sendInput(type, data) {
+    if (inputSocket && inputSocket.readyState === WebSocket.OPEN) {
+        inputSocket.send(JSON.stringify(Object.assign({type: type, seq: ++inputSeq}, data)));
+        return;
+    }
+
+    // Channel not open yet - fall back to a plain request
+    fetch('/api/' + type, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(Object.assign({client: clientId}, data))
+    }).catch(error => console.error('Input error:', error));
+}
+
+function refreshScreen() {
+    deltaSeq = 0; // Ask for a full keyframe
+    stopScreenUpdates();
+    startScreenUpdates();
+}
+
+function showKeyboard() {
+    // Focus on a hidden input to trigger mobile keyboard
+    const input = document.createElement('input');
+    input.style.opacity = '0';
+    input.style.position = 'absolute';
+    input.style.left = '-9999px';
+    document.body.appendChild(input);
+    input.focus();
+    setTimeout(() => document.body.removeChild(input), 1000);
+}
+
+function resetConnection() {
+    location.reload();
+}
+
+function toggleFullscreen() {
+    if (document.fullscreenElement) {
+        document.exitFullscreen();
+    } else {
+        document.documentElement.requestFullscreen();
+    }
+}
+
+// Initialize when page loads
+window.addEventListener('load', init);
+
+// Handle visibility changes
+document.addEventListener('visibilitychange', function() {
+    if (document.hidden) {
+        stopScreenUpdates();
+    } else {
+        startScreenUpdates();
+    }
+});
+'''
+
+APP_HTML = '''
 <!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Remote iOS Testing Station</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: #1a1a1a;
-            color: white;
-            overflow: hidden;
-        }
-        
-        .container {
-            display: flex;
-            flex-direction: column;
-            height: 100vh;
-        }
-        
-        .header {
-            background: rgba(0, 0, 0, 0.8);
-            padding: 10px 20px;
-            border-bottom: 1px solid #333;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            z-index: 1000;
-        }
-        
-        .title {
-            font-size: 1.2rem;
-            font-weight: 600;
-        }
-        
-        .status {
-            display: flex;
-            gap: 20px;
-            align-items: center;
-            font-size: 0.9rem;
-        }
-        
-        .status-item {
-            display: flex;
-            align-items: center;
-            gap: 5px;
-        }
-        
-        .status-dot {
-            width: 8px;
-            height: 8px;
-            border-radius: 50%;
-            background: #666;
-        }
-        
-        .status-dot.connected {
-            background: #4ade80;
-            animation: pulse 2s infinite;
-        }
-        
-        .status-dot.waiting {
-            background: #fbbf24;
-        }
-        
-        @keyframes pulse {
-            0%, 100% { opacity: 1; }
-            50% { opacity: 0.5; }
-        }
-        
-        .app-display {
-            flex: 1;
-            position: relative;
-            background: #000;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            overflow: hidden;
-        }
-        
-        .app-screen {
-            max-width: 100%;
-            max-height: 100%;
-            cursor: pointer;
-            border-radius: 8px;
-            box-shadow: 0 4px 20px rgba(0, 0, 0, 0.5);
-            transition: transform 0.1s ease;
-        }
-        
-        .app-screen:active {
-            transform: scale(0.99);
-        }
-        
-        .loading {
-            position: absolute;
-            top: 50%;
-            left: 50%;
-            transform: translate(-50%, -50%);
-            text-align: center;
-        }
-        
-        .spinner {
-            width: 40px;
-            height: 40px;
-            border: 4px solid #333;
-            border-top: 4px solid #4ade80;
-            border-radius: 50%;
-            animation: spin 1s linear infinite;
-            margin: 0 auto 20px;
-        }
-        
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-        
-        .controls {
-            position: absolute;
-            bottom: 20px;
-            right: 20px;
-            display: flex;
-            gap: 10px;
-            z-index: 1000;
-        }
-        
-        .control-btn {
-            background: rgba(0, 0, 0, 0.8);
-            border: 1px solid #333;
-            color: white;
-            padding: 8px 12px;
-            border-radius: 6px;
-            cursor: pointer;
-            font-size: 0.9rem;
-            transition: all 0.2s ease;
-        }
-        
-        .control-btn:hover {
-            background: rgba(255, 255, 255, 0.1);
-            border-color: #666;
-        }
-        
-        .fullscreen-btn {
-            position: absolute;
-            top: 20px;
-            right: 20px;
-            background: rgba(0, 0, 0, 0.6);
-            border: none;
-            color: white;
-            padding: 8px;
-            border-radius: 4px;
-            cursor: pointer;
-            z-index: 1000;
-        }
-        
-        .connection-overlay {
-            position: absolute;
-            top: 0;
-            left: 0;
-            right: 0;
-            bottom: 0;
-            background: rgba(0, 0, 0, 0.9);
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            flex-direction: column;
-            z-index: 500;
-        }
-        
-        .hidden {
-            display: none;
-        }
-    </style>
+    <link rel="stylesheet" href="{css_url}">
 </head>
 <body>
     <div class="container">
@@ -258,431 +840,2601 @@ class WebDisplayHandler(BaseHTTPRequestHandler):
                 </div>
             </div>
         </div>
-        
+
         <div class="app-display">
             <img id="appScreen" class="app-screen hidden" alt="Testing App">
-            
+            <canvas id="appCanvas" class="app-screen hidden"></canvas>
+
             <div id="loadingScreen" class="loading">
                 <div class="spinner"></div>
                 <h3>Connecting to Testing App...</h3>
                 <p>Please wait while we establish connection</p>
             </div>
-            
+
             <div id="connectionOverlay" class="connection-overlay hidden">
                 <h2>🔌 Connect Your Device</h2>
                 <p>Plug in your iPhone or iPad to begin testing</p>
                 <div class="spinner" style="margin-top: 20px;"></div>
             </div>
-            
+
             <button class="fullscreen-btn" onclick="toggleFullscreen()" title="Toggle Fullscreen">
                 ⛶
             </button>
         </div>
-        
+
         <div class="controls">
             <button class="control-btn" onclick="refreshScreen()">🔄 Refresh</button>
             <button class="control-btn" onclick="showKeyboard()">⌨️ Keyboard</button>
             <button class="control-btn" onclick="resetConnection()">🔄 Reset</button>
+            <button class="control-btn hidden" id="claimBtn" onclick="claimSession()">🎮 Take Control</button>
+            <button class="control-btn" id="uploadBtn" onclick="document.getElementById('uploadInput').click()">📦 Upload Build</button>
+            <input type="file" id="uploadInput" class="hidden" onchange="uploadBuild(this.files[0]); this.value = '';">
         </div>
     </div>
+
+    <script src="{js_url}"></script>
+</body>
+</html>
+'''
+
+class StaticAsset:
+    """One immutable response body with its precompressed variants"""
     
-    <script>
-        let screenImg = document.getElementById('appScreen');
-        let loadingScreen = document.getElementById('loadingScreen');
-        let connectionOverlay = document.getElementById('connectionOverlay');
-        let isLoaded = false;
-        let updateInterval;
-        let clickCooldown = false;
-        
-        // Initialize
-        function init() {
-            startScreenUpdates();
-            startStatusUpdates();
-            setupClickHandler();
-            setupKeyboardHandler();
-        }
+    def __init__(self, path, body, content_type, cache_control):
+        self.path = path
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
         
-        function startScreenUpdates() {
-            updateInterval = setInterval(updateScreen, 500); // 2 FPS for responsiveness
-            updateScreen(); // Initial load
-        }
-        
-        function updateScreen() {
-            const img = new Image();
-            img.onload = function() {
-                screenImg.src = this.src;
-                if (!isLoaded) {
-                    isLoaded = true;
-                    loadingScreen.classList.add('hidden');
-                    screenImg.classList.remove('hidden');
-                    document.getElementById('appStatus').classList.add('connected');
-                    document.getElementById('appText').textContent = 'App: Connected';
-                }
-            };
-            img.onerror = function() {
-                if (isLoaded) {
-                    document.getElementById('appStatus').classList.remove('connected');
-                    document.getElementById('appText').textContent = 'App: Disconnected';
-                }
-            };
-            img.src = '/api/screenshot?' + Date.now(); // Cache busting
-        }
+        # encoding -> (body, etag); each representation gets its own strong ETag
+        self.variants = {None: (body, f'"{self.digest}"')}
+        self.variants['gzip'] = (gzip.compress(body, 9, mtime=0), f'"{self.digest}-gzip"')
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(body, quality=11), f'"{self.digest}-br"')
+    
+    def matches(self, if_none_match):
+        """Whether an If-None-Match header names any representation of this asset"""
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return '*' in tags or any(etag in tags for _, etag in self.variants.values())
+    
+    def negotiate(self, accept_encoding):
+        """Pick the smallest variant the client accepts"""
+        accepted = set()
+        for item in accept_encoding.lower().split(','):
+            coding, _, params = item.partition(';')
+            _, _, quality = params.replace(' ', '').partition('q=')
+            try:
+                if float(quality or 1) > 0:
+                    accepted.add(coding.strip())
+            except ValueError:
+                pass
         
-        function startStatusUpdates() {
-            setInterval(updateStatus, 2000);
-            updateStatus();
-        }
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return encoding
+        return None
+
+class StaticAssets:
+    """The web UI, built and compressed once and then served from memory
+    
+    CSS and JS live under content-hashed /static/ URLs that can be cached
+    forever; the page that references them is revalidated by ETag.
+    """
+    
+    IMMUTABLE = 'public, max-age=31536000, immutable'
+    
+    def __init__(self):
+        load_dependencies()
+        css = self.build('app', '.css', APP_CSS, 'text/css; charset=utf-8')
+        js = self.build('app', '.js', APP_JS, 'application/javascript; charset=utf-8')
+        self.assets = {asset.path: asset for asset in (css, js)}
         
-        function updateStatus() {
-            fetch('/api/status')
-                .then(response => response.json())
-                .then(data => {
-                    updateUSBStatus(data.usb);
-                    updateSessionInfo(data.session);
+        html = APP_HTML.replace('{css_url}', css.path).replace('{js_url}', js.path)
+        self.page = StaticAsset('/', html.encode(), 'text/html; charset=utf-8', 'no-cache')
+    
+    def build(self, stem, extension, text, content_type):
+        body = text.encode()
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        return StaticAsset(f'/static/{stem}.{digest}{extension}', body, content_type, self.IMMUTABLE)
+    
+    def get(self, path):
+        return self.assets.get(path)
+
+class RequestError(Exception):
+    """A malformed request body, answered with 400"""
+
+class WebDisplayHandler:
+    """Asyncio HTTP handler for web-based app display"""
+    
+    server_version = f'USBTestingStation/{VERSION}'
+    protocol_version = 'HTTP/1.1'
+    keepalive_timeout = 75
+    stream_send_buffer = 64 * 1024
+    
+    # Every path do_GET/do_POST answer, so request metrics only get known labels
+    ROUTES = {
+        'GET': frozenset(('/', '/api/screenshot', '/api/stream', '/api/delta',
+                          '/api/click', '/api/status', '/api/events', '/metrics', '/api/ws',
+                          '/api/upload', '/api/builds', '/static')),
+        'POST': frozenset(('/api/click', '/api/key', '/api/upload', '/api/session/claim',
+                           '/api/session/release'))
+    }
+    
+    # Connections that stay open for the viewer's whole visit; timed apart from requests
+    STREAMING_ROUTES = frozenset(('/api/stream', '/api/events', '/api/ws'))
+    
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.rfile = reader
+        self.wfile = writer
+        self.client_address = writer.get_extra_info('peername')
+        self.command = None
+        self.path = ''
+        self.status_code = None
+        self.close_connection = True
+        self.headers_sent = False
+        self.body_pending = 0
+        self._headers_buffer = []
+    
+    async def handle(self):
+        """Serve requests on one connection until either side closes it"""
+        try:
+            while await self.parse_request():
+                started = time.perf_counter()
+                try:
+                    try:
+                        method = getattr(self, f'do_{self.command}', None)
+                        if method is None:
+                            self.send_error(501)
+                        else:
+                            await method()
+                    except (ConnectionError, asyncio.IncompleteReadError):
+                        raise
+                    except RequestError as e:
+                        if not self.headers_sent:
+                            self.send_error(400, str(e))
+                        self.close_connection = True
+                    except Exception as e:
+                        print(f"Request error ({self.command} {self.path}): {e}")
+                        if not self.headers_sent:
+                            self.send_error(500)
+                        self.close_connection = True
                     
-                    if (data.usb.connected) {
-                        connectionOverlay.classList.add('hidden');
-                    } else {
-                        connectionOverlay.classList.remove('hidden');
-                    }
-                })
-                .catch(error => {
-                    console.error('Status update error:', error);
-                });
-        }
+                    # A body the handler did not read would corrupt the next request
+                    if self.body_pending:
+                        self.close_connection = True
+                    
+                    await self.wfile.drain()
+                finally:
+                    # Streams usually end with the viewer hanging up, so record either way
+                    self.record_request(time.perf_counter() - started)
+                if self.close_connection:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.wfile.close()
+    
+    def record_request(self, seconds):
+        """Time a request; streams go to their own metric, not request latency"""
+        route = self.route()
+        if route in self.STREAMING_ROUTES:
+            HTTP_STREAM_SECONDS.observe(seconds, route=route)
+        else:
+            HTTP_REQUEST_SECONDS.observe(seconds, route=route, status=self.status_code or 0)
+    
+    async def parse_request(self):
+        """Read the request line and headers of the next request"""
+        try:
+            raw = await asyncio.wait_for(self.rfile.readuntil(b'\r\n\r\n'),
+                                         self.keepalive_timeout)
+        except asyncio.LimitOverrunError:
+            self.send_error(431)
+            return False
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return False
         
-        function updateUSBStatus(usb) {
-            const statusDot = document.getElementById('usbStatus');
-            const statusText = document.getElementById('usbText');
-            
-            if (usb.connected) {
-                statusDot.classList.add('connected');
-                statusText.textContent = `USB: ${usb.device_name}`;
-            } else if (usb.queue > 0) {
-                statusDot.classList.add('waiting');
-                statusDot.classList.remove('connected');
-                statusText.textContent = `USB: Queue (${usb.queue})`;
-            } else {
-                statusDot.classList.remove('connected', 'waiting');
-                statusText.textContent = 'USB: Waiting...';
-            }
-        }
+        request_line, _, header_text = raw.decode('iso-8859-1').partition('\r\n')
+        parts = request_line.split()
+        if len(parts) != 3:
+            self.send_error(400)
+            return False
         
-        function updateSessionInfo(session) {
-            const sessionInfo = document.getElementById('sessionInfo');
-            if (session.active) {
-                const remaining = Math.max(0, session.remaining);
-                sessionInfo.textContent = `Session: ${remaining}s remaining`;
-            } else {
-                sessionInfo.textContent = 'Session: --';
-            }
-        }
+        self.command, self.path, self.request_version = parts
+        self.query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        self.headers = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(header_text)
+        self.headers_sent = False
+        self.body_chunked = 'chunked' in self.headers.get('Transfer-Encoding', '').lower()
+        length = self.headers.get('Content-Length', '').strip() or '0'
+        if not self.body_chunked and not (length.isascii() and length.isdigit()):
+            # Where this body ends is unknown, so the connection cannot be reused
+            self.close_connection = True
+            self.send_error(400, 'Invalid Content-Length')
+            return False
+        # -1: a chunked body of unknown length
+        self.body_pending = -1 if self.body_chunked else int(length)
         
-        function setupClickHandler() {
-            screenImg.addEventListener('click', function(e) {
-                if (clickCooldown) return;
-                clickCooldown = true;
-                setTimeout(() => clickCooldown = false, 200);
-                
-                const rect = screenImg.getBoundingClientRect();
-                const scaleX = screenImg.naturalWidth / rect.width;
-                const scaleY = screenImg.naturalHeight / rect.height;
-                
-                const x = Math.round((e.clientX - rect.left) * scaleX);
-                const y = Math.round((e.clientY - rect.top) * scaleY);
-                
-                // Visual feedback
-                screenImg.style.filter = 'brightness(1.2)';
-                setTimeout(() => screenImg.style.filter = '', 100);
-                
-                // Send click to server
-                fetch('/api/click', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({x: x, y: y})
-                }).catch(error => console.error('Click error:', error));
-            });
-        }
+        connection = self.headers.get('Connection', '').lower()
+        if self.request_version == 'HTTP/1.1':
+            self.close_connection = connection == 'close'
+        else:
+            self.close_connection = connection != 'keep-alive'
+        return True
+    
+    def get_ladder_level(self):
+        """Return the quality level a client pinned with ?level=, if any"""
+        if 'level' not in self.query:
+            return None
+        levels = len(self.server.capture_service.ladder)
+        return min(max(int(self.get_query_float('level', 0)), 0), levels - 1)
+    
+    def get_query_float(self, name, default):
+        """Return a numeric query parameter, or default if missing or invalid"""
+        try:
+            return float(self.query[name][0])
+        except (KeyError, IndexError, ValueError):
+            return default
+    
+    def route(self):
+        """Low-cardinality route label for metrics, taken from the fixed ROUTES table"""
+        if self.status_code in (404, 501):
+            return 'unmatched'
+        path = self.path.split('?')[0]
+        if path.startswith('/static/'):
+            path = '/static'
+        elif path.startswith('/api/builds/'):
+            path = '/api/builds'
+        return path if path in self.ROUTES.get(self.command, ()) else 'unmatched'
+    
+    async def read_body(self):
+        """Read the complete request body"""
+        return b''.join([chunk async for chunk in self.iter_body()])
+    
+    async def iter_body(self, chunk_size=65536):
+        """Yield the request body in pieces of at most chunk_size bytes
         
-        function setupKeyboardHandler() {
-            document.addEventListener('keydown', function(e) {
-                // Don't capture system shortcuts
-                if (e.metaKey || e.ctrlKey || e.altKey) return;
-                
-                e.preventDefault();
-                
-                fetch('/api/key', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        key: e.key,
-                        code: e.code,
-                        shift: e.shiftKey
-                    })
-                }).catch(error => console.error('Key error:', error));
-            });
-        }
+        Handles Content-Length and chunked bodies. If the client disconnects
+        part way, the bytes that did arrive are yielded before the error.
+        """
+        if not self.body_pending:
+            return
+        if self.headers.get('Expect', '').lower() == '100-continue':
+            self.wfile.write(f"{self.protocol_version} 100 Continue\r\n\r\n".encode())
+            await self.wfile.drain()
         
-        function refreshScreen() {
-            updateScreen();
-        }
+        if not self.body_chunked:
+            while self.body_pending > 0:
+                try:
+                    chunk = await self.rfile.readexactly(min(chunk_size, self.body_pending))
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        yield e.partial
+                    raise
+                self.body_pending -= len(chunk)
+                yield chunk
+            return
+        
+        while True:
+            try:
+                size_line = await self.rfile.readuntil(b'\r\n')
+            except asyncio.LimitOverrunError:
+                raise RequestError('Chunk size line too long')
+            try:
+                size = int(size_line.split(b';')[0].strip(), 16)
+            except ValueError:
+                raise RequestError('Invalid chunk size')
+            if size < 0:
+                raise RequestError('Invalid chunk size')
+            if size == 0:
+                # Skip trailers up to the blank line
+                while await self.rfile.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                self.body_pending = 0
+                return
+            while size > 0:
+                try:
+                    chunk = await self.rfile.readexactly(min(chunk_size, size))
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        yield e.partial
+                    raise
+                size -= len(chunk)
+                yield chunk
+            await self.rfile.readexactly(2)
+    
+    async def read_json(self):
+        """Read and decode a JSON request body, or None if there is none"""
+        body = await self.read_body()
+        if not body:
+            return None
+        try:
+            return json.loads(body.decode())
+        except ValueError:
+            raise RequestError('Invalid JSON body')
+    
+    def send_response(self, code, message=None):
+        """Start a response with the status line and default headers"""
+        if message is None:
+            message = HTTPStatus(code).phrase
+        self.status_code = code
+        self._headers_buffer = [f"{self.protocol_version} {code} {message}\r\n"]
+        self.send_header('Server', self.server_version)
+        self.send_header('Date', email.utils.formatdate(usegmt=True))
+        self._framed = code < 200 or self.command == 'HEAD'
+        self._connection_header = False
+    
+    def send_header(self, keyword, value):
+        """Queue a response header"""
+        if keyword.lower() in ('content-length', 'transfer-encoding'):
+            self._framed = True
+        elif keyword.lower() == 'connection':
+            self._connection_header = True
+        self._headers_buffer.append(f"{keyword}: {value}\r\n")
+    
+    def end_headers(self):
+        """Finish the header block and write it out"""
+        # Without a length the body is delimited by closing the connection
+        if not self._framed:
+            self.close_connection = True
+        if self.close_connection and not self._connection_header:
+            self._headers_buffer.append("Connection: close\r\n")
+        self._headers_buffer.append("\r\n")
+        self.wfile.write(''.join(self._headers_buffer).encode('iso-8859-1'))
+        self._headers_buffer = []
+        self.headers_sent = True
+    
+    def send_error(self, code, message=None):
+        """Send a short plain-text error response"""
+        body = f"{code} {message or HTTPStatus(code).phrase}\n".encode()
+        self.send_response(code, message)
+        self.send_header('Content-type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+    
+    def send_json(self, code, data):
+        """Send a JSON response"""
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    async def do_GET(self):
+        """Handle GET requests"""
+        path = self.path.split('?')[0]
+        
+        if path == '/':
+            await self.serve_app_interface()
+        elif path == '/api/screenshot':
+            await self.serve_screenshot_api()
+        elif path == '/api/stream':
+            await self.serve_stream_api()
+        elif path == '/api/delta':
+            await self.serve_delta_api()
+        elif path == '/api/click':
+            await self.handle_click()
+        elif path == '/api/status':
+            await self.serve_status_api()
+        elif path == '/api/events':
+            await self.serve_events_api()
+        elif path == '/metrics':
+            self.serve_metrics()
+        elif path == '/api/ws':
+            await self.serve_input_socket()
+        elif path == '/api/upload':
+            self.serve_upload_status()
+        elif path.startswith('/api/builds/'):
+            await self.serve_build_lookup(path.rsplit('/', 1)[1].lower())
+        elif path.startswith('/static/'):
+            await self.serve_static_content(path)
+        else:
+            self.send_error(404)
+    
+    async def do_POST(self):
+        """Handle POST requests"""
+        path = self.path.split('?')[0]
+        
+        if path == '/api/click':
+            await self.handle_click()
+        elif path == '/api/key':
+            await self.handle_key()
+        elif path == '/api/upload':
+            await self.handle_upload()
+        elif path in ('/api/session/claim', '/api/session/release'):
+            await self.handle_session_control(path.rsplit('/', 1)[1])
+        else:
+            self.send_error(404)
+    
+    async def serve_app_interface(self):
+        """Serve the main web interface page"""
+        self.serve_asset(self.server.static_assets.page)
+    
+    async def serve_static_content(self, path):
+        """Serve a content-hashed CSS/JS asset"""
+        asset = self.server.static_assets.get(path)
+        if asset is None:
+            self.send_error(404)
+            return
+        self.serve_asset(asset)
+    
+    def serve_asset(self, asset):
+        """Send a prebuilt asset, compressed if the client accepts it, or a 304"""
+        if asset.matches(self.headers.get('If-None-Match', '')):
+            self.send_response(304)
+            self.send_header('ETag', asset.variants[None][1])
+            self.send_header('Cache-Control', asset.cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Content-Length', 0)
+            self.end_headers()
+            return
+        
+        encoding = asset.negotiate(self.headers.get('Accept-Encoding', ''))
+        body, etag = asset.variants[encoding]
+        
+        self.send_response(200)
+        self.send_header('Content-type', asset.content_type)
+        self.send_header('Cache-Control', asset.cache_control)
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+    
+    async def serve_screenshot_api(self):
+        """Serve the latest shared app screenshot"""
+        try:
+            # Frames come from the shared capture service, so the capture
+            # and encode cost does not grow with the number of viewers
+            frame = await self.server.wait_for_frame()
+            if frame is None:
+                self.send_error(503)
+                return
+            
+            # Quality level: pinned with ?level=, else adapted per ?client= id
+            capture = self.server.capture_service
+            level = self.get_ladder_level()
+            controller = None
+            if level is None:
+                level = 0
+                client_id = self.query.get('client', [None])[0]
+                if client_id:
+                    controller = self.server.get_quality_controller(client_id)
+                    # The socket buffer takes a whole frame at once, so the
+                    # client reports how long its previous frame took to arrive
+                    received = int(self.get_query_float('rx_bytes', 0))
+                    if received > 0:
+                        seconds = self.get_query_float('rx_ms', 0) / 1000
+                        if seconds > 0.001:
+                            controller.record(received, seconds)
+                        else:
+                            controller.record_unblocked()
+                    level = controller.select(capture.estimate_level_sizes())
+            
+            etag = f'"{frame.fingerprint}-{level}"' if frame.fingerprint else None
+            
+            # Unchanged screen: the client already has these bytes
+            if etag and etag in self.headers.get('If-None-Match', ''):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Content-Length', 0)
+                self.end_headers()
+                return
+            
+            img_bytes = await self.server.get_variant(frame, level)
+            
+            self.send_response(200)
+            self.send_header('Content-type', 'image/jpeg')
+            self.send_header('Cache-Control', 'no-cache')
+            if etag:
+                self.send_header('ETag', etag)
+            self.send_header('X-Frame-Level', level)
+            if frame.timings:
+                self.send_header('Server-Timing', ', '.join(
+                    f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in frame.timings.items()))
+            self.send_header('Content-Length', len(img_bytes))
+            self.end_headers()
+            self.wfile.write(img_bytes)
+            
+            
+        except Exception as e:
+            print(f"Screenshot error: {e}")
+            self.send_error(500)
+    
+    async def serve_stream_api(self):
+        """Push frames as a multipart/x-mixed-replace MJPEG stream"""
+        capture = self.server.capture_service
+        fps = min(max(self.get_query_float('fps', capture.fps), 0.1), capture.fps)
+        interval = 1.0 / fps
+        boundary = 'frame'
+        
+        # The stream only ends when the client goes away
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-type', f'multipart/x-mixed-replace; boundary={boundary}')
+        self.send_header('Cache-Control', 'no-cache, no-store')
+        self.end_headers()
+        
+        forced_level = self.get_ladder_level()
+        controller = AdaptiveQualityController(interval, len(capture.ladder))
+        
+        # Keep little in flight, so drain() waits on the client's real rate
+        # instead of returning as soon as the kernel buffer swallows a frame
+        sock = self.wfile.get_extra_info('socket')
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.stream_send_buffer)
+        except (AttributeError, OSError):
+            pass
+        self.wfile.transport.set_write_buffer_limits(high=0)
+        
+        seq = 0
+        while not self.wfile.is_closing():
+            frame = await self.server.wait_for_frame(seq)
+            if frame is None:
+                continue
+            
+            if forced_level is None:
+                level = controller.select(capture.estimate_level_sizes())
+            else:
+                level = forced_level
+            jpeg = await self.server.get_variant(frame, level)
+            
+            sent_at = self.server.loop.time()
+            part_header = (f"--{boundary}\r\n"
+                           f"Content-Type: image/jpeg\r\n"
+                           f"Content-Length: {len(jpeg)}\r\n\r\n").encode()
+            self.wfile.write(part_header + jpeg + b"\r\n")
+            
+            # Backpressure: a slow client simply skips to the latest frame.
+            # What the socket could not take at once is what the link had to carry.
+            pending = self.wfile.transport.get_write_buffer_size()
+            await self.wfile.drain()
+            if pending:
+                controller.record(pending, self.server.loop.time() - sent_at)
+            else:
+                controller.record_unblocked()
+            seq = frame.seq
+            
+            delay = interval - (self.server.loop.time() - sent_at)
+            if delay > 0:
+                await asyncio.sleep(delay)
+    
+    async def serve_delta_api(self):
+        """Long-poll for the tiles that changed since the client's last frame"""
+        try:
+            capture = self.server.capture_service
+            since = int(self.get_query_float('since', 0))
+            if since > capture.frame_seq:
+                since = 0  # Sequence from before a restart
+            
+            frame = await self.server.wait_for_frame(since)
+            if frame is None:
+                self.send_response(204)
+                self.send_header('Content-Length', 0)
+                self.end_headers()
+                return
+            
+            delta = await self.server.run_encode(capture.delta_tracker.build_delta, frame, since)
+            body = json.dumps(delta).encode()
+            
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Content-Length', len(body))
+            self.end_headers()
+            self.wfile.write(body)
+            
+        except Exception as e:
+            print(f"Delta error: {e}")
+            self.send_error(500)
+    
+    async def handle_click(self):
+        """Handle mouse click from web interface"""
+        try:
+            data = await self.read_json()
+            if data is not None and not self.server.may_control(data.get('client')):
+                response = {'success': False, 'error': 'Session is controlled by another client'}
+                self.send_json(403, response)
+                return
+            if data is not None:
+                x = data.get('x', 0)
+                y = data.get('y', 0)
+                
+                # Bounds lookup and pyautogui block, so they run on the input executor
+                await self.server.run_input(self.server.inject_click, x, y,
+                                            data.get('width'), data.get('height'))
+                
+                response = {'success': True}
+            else:
+                response = {'success': False, 'error': 'No data'}
+            
+            self.send_json(200, response)
+            
+        except RequestError:
+            raise
+        except Exception as e:
+            print(f"Click error: {e}")
+            self.send_json(500, {'success': False, 'error': str(e)})
+    
+    async def handle_key(self):
+        """Handle keyboard input from web interface"""
+        try:
+            data = await self.read_json()
+            if data is not None and not self.server.may_control(data.get('client')):
+                response = {'success': False, 'error': 'Session is controlled by another client'}
+                self.send_json(403, response)
+                return
+            if data is not None:
+                await self.server.run_input(self.server.inject_key, data.get('key', ''))
+                
+                response = {'success': True}
+            else:
+                response = {'success': False, 'error': 'No data'}
+            
+            self.send_json(200, response)
+            
+        except RequestError:
+            raise
+        except Exception as e:
+            print(f"Key error: {e}")
+            self.send_json(500, {'success': False, 'error': str(e)})
+    
+    async def handle_upload(self):
+        """Stream a build to disk: POST /api/upload?upload=<id>&name=<file>&offset=<n>[&total=<n>]
+        
+        The body is appended at offset, which must equal the bytes already
+        received for that upload id. When offset + body reaches total the
+        file is finished and its SHA-256 returned. An interrupted upload is
+        resumed by asking GET /api/upload?upload=<id> for the offset.
+        """
+        store = self.server.upload_store
+        upload_id = self.query.get('upload', [''])[0]
+        name = self.query.get('name', [''])[0]
+        offset = int(self.get_query_float('offset', 0))
+        total = int(self.get_query_float('total', -1))
+        
+        if not store.valid_id(upload_id) or not name:
+            self.send_json(400, {'success': False, 'error': 'upload and name are required'})
+            return
+        if total > store.max_bytes or offset + max(self.body_pending, 0) > store.max_bytes:
+            self.send_json(413, {'success': False, 'error': 'Upload too large'})
+            return
+        
+        # Already stored: answer before reading the body, so an Expect: 100-continue
+        # client never sends it
+        expected = (self.query.get('sha256', [''])[0] or '').lower()
+        if offset == 0 and store.build_store.valid_hash(expected):
+            entry = await self.server.run_io(store.build_store.lookup, expected)
+            if entry is not None:
+                self.send_json(200, {'success': True, 'complete': True, 'cached': True,
+                                     'name': store.safe_name(name), 'size': entry['size'],
+                                     'sha256': expected})
+                return
+        
+        state = await self.server.run_io(store.open, upload_id, name, self.client_address[0])
+        if state is None:
+            self.send_json(429, {'success': False, 'error': 'Too many uploads in progress'})
+            return
+        if state.busy:
+            self.send_json(409, {'success': False, 'error': 'Upload in progress', 'offset': state.size})
+            return
+        if offset != state.size:
+            self.send_json(409, {'success': False, 'error': 'Offset mismatch', 'offset': state.size})
+            return
+        
+        state.busy = True
+        try:
+            try:
+                async for chunk in self.iter_body(store.chunk_size):
+                    # A chunked body has no length up front, so the cap is checked as it arrives
+                    if state.size + len(chunk) > store.max_bytes:
+                        await self.server.run_io(store.discard, state)
+                        self.send_json(413, {'success': False, 'error': 'Upload too large'})
+                        return
+                    if not await self.server.run_io(store.append, state, chunk):
+                        # Kept, so it can resume once other uploads finish or expire
+                        self.send_json(507, {'success': False, 'error': 'Upload space full',
+                                             'offset': state.size})
+                        return
+            except (ConnectionError, asyncio.IncompleteReadError):
+                print(f"⏸️ Upload {upload_id} interrupted at {state.size} bytes")
+                raise
+            
+            if 0 <= total <= state.size or self.query.get('final', [''])[0] == '1':
+                result = await self.server.run_io(store.finish, state, expected or None)
+                if 'error' in result:
+                    self.send_json(422, dict(result, success=False))
+                    return
+                print(f"📦 Upload complete: {result['name']} ({result['size']} bytes)")
+                self.send_json(200, dict(result, success=True, complete=True))
+            else:
+                self.send_json(200, {'success': True, 'complete': False, 'offset': state.size})
+        finally:
+            state.busy = False
+    
+    async def serve_build_lookup(self, sha256):
+        """Answer "do you have build X?" so a client can skip uploading it"""
+        store = self.server.build_store
+        if not store.valid_hash(sha256):
+            self.send_json(400, {'success': False, 'error': 'Expected a SHA-256 hex digest'})
+            return
+        entry = await self.server.run_io(store.lookup, sha256)
+        if entry is None:
+            self.send_json(404, {'success': False, 'sha256': sha256})
+        else:
+            self.send_json(200, {'success': True, 'sha256': sha256, 'size': entry['size'],
+                                 'names': entry['names']})
+    
+    def serve_upload_status(self):
+        """Report how many bytes of an upload the server has, to resume from"""
+        upload_id = self.query.get('upload', [''])[0]
+        store = self.server.upload_store
+        if not store.valid_id(upload_id):
+            self.send_json(400, {'success': False, 'error': 'upload is required'})
+            return
+        self.send_json(200, {'success': True, 'offset': store.offset(upload_id)})
+    
+    async def handle_session_control(self, action):
+        """Claim or release control of a device session for a client"""
+        try:
+            data = await self.read_json() or {}
+            station = self.server.station
+            session_id = data.get('session')
+            client = data.get('client')
+            
+            if station is None or not isinstance(session_id, int) or not client:
+                self.send_json(400, {'success': False, 'error': 'session and client are required'})
+                return
+            
+            if action == 'release':
+                released = station.sessions.release(session_id, client)
+                self.server.publish_status()
+                self.send_json(200 if released else 409, {'success': released})
+                return
+            
+            session, error = station.sessions.claim(session_id, client)
+            if error:
+                self.send_json(404 if session is None else 409, {'success': False, 'error': error})
+            else:
+                print(f"🎮 Client {client} controls session {session.id}")
+                self.server.client_claimed(client)
+                self.server.publish_status()
+                self.send_json(200, {'success': True, 'session': session.to_dict()})
+            
+        except RequestError:
+            raise
+        except Exception as e:
+            print(f"Session control error: {e}")
+            self.send_json(500, {'success': False, 'error': str(e)})
+    
+    async def serve_input_socket(self):
+        """WebSocket channel carrying sequenced click/key events, acked in batches"""
+        key = self.headers.get('Sec-WebSocket-Key')
+        if 'websocket' not in self.headers.get('Upgrade', '').lower() or not key:
+            self.send_error(400, 'Expected WebSocket upgrade')
+            return
+        
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', WebSocketConnection.accept_key(key))
+        self.end_headers()
+        self.close_connection = True
+        
+        ws = WebSocketConnection(self.rfile, self.wfile)
+        client = self.query.get('client', [None])[0]
+        events = asyncio.Queue()
+        dispatcher = asyncio.ensure_future(self.dispatch_input(ws, events, client))
+        self.server.client_connected(client)
+        try:
+            last_seq = 0
+            while True:
+                message = await ws.recv()
+                if message is None:
+                    break
+                
+                try:
+                    event = json.loads(message)
+                    seq = int(event.get('seq', 0))
+                except (ValueError, TypeError, AttributeError):
+                    await ws.send_json({'type': 'error', 'error': 'Invalid event'})
+                    continue
+                
+                # Duplicates of already applied events are dropped, not replayed
+                if seq and seq <= last_seq:
+                    continue
+                last_seq = seq or last_seq
+                events.put_nowait(event)
+        finally:
+            # Apply whatever already arrived, then let the dispatcher finish
+            events.put_nowait(None)
+            await dispatcher
+            self.server.client_disconnected(client)
+    
+    async def dispatch_input(self, ws, events, client=None):
+        """Apply queued input events in order, coalescing bursts into one batch"""
+        done = False
+        while not done:
+            batch = [await events.get()]
+            if batch[0] is None:
+                break
+            
+            # Everything that arrived while the previous batch ran goes together
+            while len(batch) < self.server.input_batch_size and not events.empty():
+                event = events.get_nowait()
+                if event is None:
+                    done = True
+                    break
+                batch.append(event)
+            
+            # Checked per batch, since claims change while the socket is open
+            if self.server.may_control(client):
+                errors = await self.server.run_input(self.server.inject_events, batch)
+            else:
+                errors = [{'seq': event.get('seq'), 'error': 'Session is controlled by another client'}
+                          for event in batch]
+            try:
+                await ws.send_json({
+                    'type': 'ack',
+                    'seq': batch[-1].get('seq'),
+                    'count': len(batch),
+                    'errors': errors
+                })
+            except ConnectionError:
+                pass
+    
+    def serve_metrics(self):
+        """Serve Prometheus metrics"""
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    async def serve_status_api(self):
+        """Serve status information"""
+        try:
+            if self.server.status_body is None:
+                self.server.publish_status()
+            body = self.server.status_body
+            
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Length', len(body))
+            self.end_headers()
+            self.wfile.write(body)
+            
+        except Exception as e:
+            print(f"Status error: {e}")
+            self.send_error(500)
+    
+    async def serve_events_api(self):
+        """Push status snapshots as Server-Sent Events"""
+        server = self.server
+        if server.status_body is None:
+            server.publish_status()
+        
+        # The stream only ends when the client goes away
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(b"retry: 2000\n\n")
+        
+        # A reconnecting EventSource that already has this version skips it
+        last_id = self.headers.get('Last-Event-ID', '')
+        version = int(last_id) if last_id.isdigit() else 0
+        
+        client = self.query.get('client', [None])[0]
+        server.event_subscribers += 1
+        server.client_connected(client)
+        # An EventSource sends nothing after its request, so a read only
+        # returns once it hangs up; that releases its claims without waiting
+        # for a keep-alive write to fail
+        hangup = asyncio.ensure_future(self.rfile.read(1))
+        changed = None
+        try:
+            while not self.wfile.is_closing() and not hangup.done():
+                if server.status_version != version:
+                    # Every subscriber shares the one pre-encoded message
+                    version = server.status_version
+                    self.wfile.write(server.status_message)
+                    await self.wfile.drain()
+                    continue
+                
+                changed = asyncio.ensure_future(server.status_event.wait())
+                done, _ = await asyncio.wait({changed, hangup}, timeout=server.keepalive_interval,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if changed not in done:
+                    changed.cancel()
+                if not done:
+                    self.wfile.write(b": keep-alive\n\n")
+                    await self.wfile.drain()
+        finally:
+            hangup.cancel()
+            if changed is not None:
+                changed.cancel()
+            server.event_subscribers -= 1
+            server.client_disconnected(client)
+
+class WebSocketProtocolError(Exception):
+    """A client frame that breaks RFC 6455, answered with close 1002"""
+
+class WebSocketConnection:
+    """Minimal RFC 6455 WebSocket endpoint over an asyncio stream"""
+    
+    GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+    OP_CONTINUATION = 0x0
+    OP_TEXT = 0x1
+    OP_BINARY = 0x2
+    OP_CLOSE = 0x8
+    OP_PING = 0x9
+    OP_PONG = 0xA
+    max_message_size = 65536
+    
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+    
+    @staticmethod
+    def accept_key(key):
+        """Compute the Sec-WebSocket-Accept value for a handshake key"""
+        digest = hashlib.sha1((key + WebSocketConnection.GUID).encode()).digest()
+        return base64.b64encode(digest).decode()
+    
+    async def read_frame(self):
+        """Read one frame, returning (fin, opcode, payload)"""
+        head = await self.reader.readexactly(2)
+        fin = bool(head[0] & 0x80)
+        opcode = head[0] & 0x0F
+        masked = head[1] & 0x80
+        length = head[1] & 0x7F
+        if not masked:
+            # RFC 6455 5.1: clients must mask every frame
+            raise WebSocketProtocolError("Unmasked client frame")
+        
+        if length == 126:
+            length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+        if length > self.max_message_size:
+            raise ValueError(f"WebSocket frame too large ({length} bytes)")
+        
+        mask = await self.reader.readexactly(4)
+        payload = await self.reader.readexactly(length)
+        if length:
+            # XOR the whole payload with the repeated mask in one integer operation
+            key = (mask * (length // 4 + 1))[:length]
+            payload = (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+        
+        return fin, opcode, payload
+    
+    async def recv(self):
+        """Return the next text message, or None once the connection is closed"""
+        message = []
+        size = 0
+        try:
+            while not self.closed:
+                fin, opcode, payload = await self.read_frame()
+                
+                if opcode == self.OP_PING:
+                    await self.send_frame(self.OP_PONG, payload)
+                elif opcode == self.OP_CLOSE:
+                    await self.close()
+                elif opcode == self.OP_PONG:
+                    continue
+                else:
+                    size += len(payload)
+                    if size > self.max_message_size:
+                        await self.close(1009)
+                        break
+                    message.append(payload)
+                    if fin:
+                        return b''.join(message).decode('utf-8', errors='replace')
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.closed = True
+        except WebSocketProtocolError:
+            await self.close(1002)
+        except ValueError:
+            await self.close(1009)
+        return None
+    
+    async def send_frame(self, opcode, payload):
+        """Write one unmasked, unfragmented frame"""
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        self.writer.write(header + payload)
+        await self.writer.drain()
+    
+    async def send_json(self, data):
+        """Send a JSON text message"""
+        await self.send_frame(self.OP_TEXT, json.dumps(data).encode())
+    
+    async def close(self, code=1000):
+        """Send a close frame (once) and mark the connection closed"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.send_frame(self.OP_CLOSE, struct.pack('!H', code))
+        except ConnectionError:
+            pass
+
+class BuildStore:
+    """Content-addressed store of uploaded builds, keyed by SHA-256
+    
+    Objects live in objects/<sha256>; index.json records sizes, file names
+    and last use so LRU order survives restarts. Adding past max_bytes
+    evicts the least recently used builds. Nothing touches the directory
+    until the first lookup or add.
+    """
+    
+    flush_interval = 60
+    
+    def __init__(self, directory, max_bytes=20 * 1024 ** 3):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, 'objects')
+        self.index_path = os.path.join(directory, 'index.json')
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # sha256 -> entry, least recently used first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.dirty = False  # last_used changed since the index was written
+        self.saved_at = time.monotonic()
+    
+    @staticmethod
+    def valid_hash(sha256):
+        return len(sha256) == 64 and all(c in '0123456789abcdef' for c in sha256)
+    
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256)
+    
+    def load(self):
+        """Read the index on first use (call with the lock held)
+        
+        Entries whose object is gone are dropped. Objects the index does not
+        know about, including every object when the index is missing or
+        unreadable, are re-indexed from their file name and size.
+        """
+        if self.loaded:
+            return
+        self.loaded = True
+        os.makedirs(self.objects_dir, exist_ok=True)
+        try:
+            with open(self.index_path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            if os.path.exists(self.index_path):
+                print(f"⚠️ Build index unreadable ({e}); rebuilding it from {self.objects_dir}")
+            stored = {}
+        
+        entries = {}
+        for sha256, entry in stored.items():
+            if self.valid_hash(sha256) and os.path.exists(self.object_path(sha256)):
+                entries[sha256] = entry
+        
+        changed = len(entries) != len(stored)
+        for name in os.listdir(self.objects_dir):
+            if name in entries:
+                continue
+            path = self.object_path(name)
+            if not self.valid_hash(name):
+                os.remove(path)  # Not an object, e.g. left from an interrupted move
+                continue
+            modified = os.path.getmtime(path)
+            entries[name] = {'size': os.path.getsize(path), 'names': [],
+                             'added': modified, 'last_used': modified}
+            changed = True
+        
+        for sha256, entry in sorted(entries.items(), key=lambda item: item[1].get('last_used', 0)):
+            self.entries[sha256] = entry
+            self.total_bytes += entry['size']
+        
+        if changed:
+            self.evict()
+            self.save()
+    
+    def save(self):
+        """Write the index atomically (call with the lock held, or before sharing)"""
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.index_path)
+        self.dirty = False
+        self.saved_at = time.monotonic()
+    
+    def flush(self):
+        """Write pending last-used times, e.g. on shutdown (blocking)"""
+        with self.lock:
+            if self.dirty:
+                self.save()
+    
+    def lookup(self, sha256):
+        """Return a build's entry and mark it recently used, or None"""
+        with self.lock:
+            self.load()
+            entry = self.entries.get(sha256)
+            if entry is None:
+                return None
+            entry['last_used'] = time.time()
+            self.entries.move_to_end(sha256)
+            # Recency only matters for eviction order; write it out now and then
+            self.dirty = True
+            if time.monotonic() - self.saved_at > self.flush_interval:
+                self.save()
+            return dict(entry, sha256=sha256, path=self.object_path(sha256))
+    
+    def add(self, sha256, path, name):
+        """Move a verified file into the store (or drop it if already stored) and return its entry"""
+        with self.lock:
+            self.load()
+            entry = self.entries.get(sha256)
+            if entry is None:
+                size = os.path.getsize(path)
+                os.replace(path, self.object_path(sha256))
+                entry = self.entries[sha256] = {'size': size, 'names': [], 'added': time.time()}
+                self.total_bytes += size
+            else:
+                os.remove(path)
+                self.entries.move_to_end(sha256)
+            
+            if name not in entry['names']:
+                entry['names'].append(name)
+            entry['last_used'] = time.time()
+            self.evict(keep=sha256)
+            self.save()
+            return dict(entry, sha256=sha256, path=self.object_path(sha256))
+    
+    def evict(self, keep=None):
+        """Drop least recently used builds until under max_bytes (call with the lock held)"""
+        for sha256 in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if sha256 == keep:
+                continue
+            entry = self.entries.pop(sha256)
+            self.total_bytes -= entry['size']
+            try:
+                os.remove(self.object_path(sha256))
+            except OSError:
+                pass
+            print(f"🗑️ Evicted cached build {sha256[:12]} ({', '.join(entry['names']) or 'unnamed'})")
+
+class UploadState:
+    """A partially received upload and its running SHA-256"""
+    
+    def __init__(self, upload_id, name, path, owner=None):
+        self.upload_id = upload_id
+        self.name = name
+        self.path = path
+        self.owner = owner
+        self.size = 0
+        self.hasher = hashlib.sha256()
+        self.busy = False
+        self.updated_at = time.monotonic()
+
+class UploadStore:
+    """Resumable uploads written to disk in fixed-size chunks
+    
+    Memory per upload is one chunk; the hash is updated as chunks land, so
+    finishing a multi-GB build does not re-read it. Partial files count
+    against max_partial_bytes, each client (by address) keeps at most
+    max_uploads_per_client of them, and idle ones are deleted after
+    stale_after seconds.
+    """
+    
+    chunk_size = 256 * 1024
+    max_bytes = 8 * 1024 ** 3
+    max_partial_bytes = 16 * 1024 ** 3
+    max_uploads_per_client = 4
+    stale_after = 24 * 3600
+    
+    def __init__(self, directory, build_store):
+        self.directory = directory
+        self.partial_dir = os.path.join(directory, 'partial')
+        self.build_store = build_store
+        self.states = {}
+        self.partial_bytes = 0  # Bytes in partial_dir, recounted by prune()
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def valid_id(upload_id):
+        return 0 < len(upload_id) <= 64 and all(c.isalnum() or c in '-_' for c in upload_id)
+    
+    @staticmethod
+    def safe_name(name):
+        name = os.path.basename(name.replace('\\', '/')).strip().lstrip('.')
+        return ''.join(c if c.isalnum() or c in '-_.+ ' else '_' for c in name)[:128] or 'upload'
+    
+    def offset(self, upload_id):
+        """Bytes already stored for an upload (0 if unknown)"""
+        with self.lock:
+            state = self.states.get(upload_id)
+        if state is not None:
+            return state.size
+        path = os.path.join(self.partial_dir, upload_id)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    
+    def open(self, upload_id, name, owner=None):
+        """Return the state of an upload, recovering a partial file left on disk (blocking)
+        
+        A client at its upload limit gives up its longest idle upload; None
+        if all of them are still receiving.
+        """
+        with self.lock:
+            os.makedirs(self.partial_dir, exist_ok=True)
+            self.prune()
+            
+            state = self.states.get(upload_id)
+            if state is not None:
+                return state
+            
+            owned = sorted((other for other in self.states.values() if other.owner == owner),
+                           key=lambda other: other.updated_at)
+            while len(owned) >= self.max_uploads_per_client:
+                oldest = next((other for other in owned if not other.busy), None)
+                if oldest is None:
+                    return None
+                owned.remove(oldest)
+                self.discard_locked(oldest)
+            
+            state = UploadState(upload_id, self.safe_name(name),
+                                os.path.join(self.partial_dir, upload_id), owner)
+            if os.path.exists(state.path):
+                # The hash state died with the old process; rebuild it from disk
+                with open(state.path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                        state.hasher.update(chunk)
+                        state.size += len(chunk)
+            else:
+                open(state.path, 'wb').close()
+            self.states[upload_id] = state
+            return state
+    
+    def append(self, state, chunk):
+        """Write one chunk at the end of the partial file (blocking)
+        
+        Returns False, writing nothing, if partial uploads would go past max_partial_bytes.
+        """
+        with self.lock:
+            if self.partial_bytes + len(chunk) > self.max_partial_bytes:
+                return False
+            self.partial_bytes += len(chunk)
+        with open(state.path, 'ab') as f:
+            f.write(chunk)
+        state.hasher.update(chunk)
+        state.size += len(chunk)
+        state.updated_at = time.monotonic()
+        return True
+    
+    def discard(self, state):
+        """Delete an upload and its partial file (blocking)"""
+        with self.lock:
+            self.discard_locked(state)
+    
+    def discard_locked(self, state):
+        """Delete an upload and its partial file (call with the lock held)"""
+        if self.states.get(state.upload_id) is state:
+            del self.states[state.upload_id]
+        try:
+            os.remove(state.path)
+        except OSError:
+            pass
+        self.partial_bytes = max(0, self.partial_bytes - state.size)
+    
+    def finish(self, state, expected_sha256=None):
+        """Verify a complete upload and hand it to the build store (blocking)"""
+        digest = state.hasher.hexdigest()
+        with self.lock:
+            self.states.pop(state.upload_id, None)
+            self.partial_bytes = max(0, self.partial_bytes - state.size)
+        
+        if expected_sha256 and expected_sha256.lower() != digest:
+            os.remove(state.path)
+            return {'error': 'SHA-256 mismatch', 'sha256': digest, 'size': state.size}
+        
+        entry = self.build_store.add(digest, state.path, state.name)
+        # Digest, size and name only: the object path is the server's business
+        return {'name': state.name, 'size': entry['size'], 'sha256': digest}
+    
+    def prune(self):
+        """Delete long-idle uploads and recount partial_dir (call with the lock held)
+        
+        Files with no state (left by an earlier run) are kept until they
+        too have been idle for stale_after, so they can still be resumed.
+        """
+        now = time.monotonic()
+        for state in [state for state in self.states.values()
+                      if not state.busy and now - state.updated_at > self.stale_after]:
+            self.discard_locked(state)
+        
+        total = 0
+        for entry in os.scandir(self.partial_dir):
+            state = self.states.get(entry.name)
+            if state is not None:
+                total += state.size
+                continue
+            stat = entry.stat()
+            if time.time() - stat.st_mtime > self.stale_after:
+                os.remove(entry.path)
+            else:
+                total += stat.st_size
+        self.partial_bytes = total
+
+class WebDisplayServer:
+    """Asyncio HTTP server for web display
+    
+    The event loop only does socket I/O; blocking work (capture and encode on
+    the capture service thread, pyautogui on the input executor) never runs on
+    it, so idle connections are cheap and input never waits behind images.
+    """
+    
+    request_queue_size = 1024
+    max_header_bytes = 65536
+    input_batch_size = 64
+    status_interval = 1.0
+    keepalive_interval = 15
+    controller_ttl = 120
+    
+    def __init__(self, server_address, handler_class, station=None, program_name=None,
+                 capture_fps=15, encode_threads=None, upload_dir=None,
+                 build_cache_bytes=20 * 1024 ** 3):
+        self.server_address = server_address
+        self.handler_class = handler_class
+        self.station = station
+        self.program_name = program_name
+        self.bounds_tracker = WindowBoundsTracker(program_name)
+        self.capture_service = ScreenCaptureService(self.get_app_bounds, fps=capture_fps,
+                                                    encode_threads=encode_threads)
+        self.capture_service.add_listener(self.on_frame)
+        
+        # A moved or resized window invalidates everything derived from old frames
+        self.bounds_tracker.add_listener(lambda bounds: self.capture_service.invalidate())
+        
+        # Input events are applied in order by a single worker
+        self.input_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='input')
+        self.encode_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='encode')
+        self.io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='io')
+        self.build_store = BuildStore(upload_dir or UPLOAD_DIR, build_cache_bytes)
+        self.upload_store = UploadStore(upload_dir or UPLOAD_DIR, self.build_store)
+        
+        self.quality_controllers = {}
+        
+        # Open /api/events and /api/ws connections per client id; a client
+        # gone for longer than claim_grace loses its session claims
+        self.client_presence = Counter()
+        self.release_timers = {}
+        self.claim_grace = 10
+        
+        self.static_assets = StaticAssets()
+        self.loop = asyncio.new_event_loop()
+        self.frame_event = None
+        self.connections = set()
+        self._stopped = threading.Event()
+        METRICS.gauge('usbtool_active_connections', 'Open HTTP connections',
+                      callback=lambda: len(self.connections))
+        
+        # Status is built and serialized once per change, then shared by every client
+        self.status_version = 0
+        self.status_body = None
+        self.status_snapshot = None
+        self.status_message = None
+        self.status_event = None
+        self.event_subscribers = 0
+        METRICS.gauge('usbtool_event_subscribers', 'Open /api/events streams',
+                      callback=lambda: self.event_subscribers)
+        
+        # Bind now so a busy port is reported to the caller right away
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(server_address)
+            self.socket.listen(self.request_queue_size)
+            self.socket.setblocking(False)
+        except OSError:
+            self.socket.close()
+            raise
+    
+    def start_services(self):
+        """Start the background bounds tracker and frame producer"""
+        self.bounds_tracker.start()
+        self.capture_service.start()
+    
+    def stop_services(self):
+        """Stop the background bounds tracker and frame producer"""
+        self.capture_service.stop()
+        self.bounds_tracker.stop()
+        try:
+            self.build_store.flush()
+        except OSError as e:
+            print(f"⚠️ Could not save build index: {e}")
+    
+    def serve_forever(self):
+        """Run the event loop until shutdown() is called"""
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.frame_event = asyncio.Event()
+            self.status_event = asyncio.Event()
+            server = self.loop.run_until_complete(asyncio.start_server(
+                self.handle_connection, sock=self.socket, limit=self.max_header_bytes))
+            ticker = self.loop.create_task(self.status_ticker())
+            self.loop.run_forever()
+            
+            ticker.cancel()
+            server.close()
+            for task in list(self.connections):
+                task.cancel()
+            self.loop.run_until_complete(
+                asyncio.gather(*self.connections, return_exceptions=True))
+        finally:
+            self.loop.close()
+            self._stopped.set()
+    
+    def shutdown(self):
+        """Stop the event loop and wait for serve_forever() to return"""
+        try:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        except RuntimeError:
+            return
+        self._stopped.wait(timeout=5)
+    
+    def server_close(self):
+        """Release the listening socket and executors"""
+        self.socket.close()
+        self.input_executor.shutdown(wait=False)
+        self.encode_executor.shutdown(wait=False)
+        self.io_executor.shutdown(wait=False)
+    
+    async def handle_connection(self, reader, writer):
+        """Serve one client connection"""
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            await self.handler_class(self, reader, writer).handle()
+        except asyncio.CancelledError:
+            pass  # Server shutting down
+        finally:
+            self.connections.discard(task)
+    
+    async def run_input(self, func, *args):
+        """Run blocking input injection on the input executor"""
+        return await self.loop.run_in_executor(self.input_executor, func, *args)
+    
+    async def run_encode(self, func, *args):
+        """Run on-demand image encoding on the encode executor"""
+        return await self.loop.run_in_executor(self.encode_executor, func, *args)
+    
+    async def run_io(self, func, *args):
+        """Run blocking file I/O on the I/O executor"""
+        return await self.loop.run_in_executor(self.io_executor, func, *args)
+    
+    async def get_variant(self, frame, level):
+        """Return a frame at a ladder level, encoding off the loop if needed"""
+        data = frame.variants.get(level)
+        if data is not None:
+            self.capture_service.level_demand[level] = time.monotonic()
+            return data
+        return await self.run_encode(self.capture_service.encode_variant, frame, level)
+    
+    def client_connected(self, client):
+        """Count a long-lived connection of a client (called on the loop)"""
+        if not client:
+            return
+        self.client_presence[client] += 1
+        timer = self.release_timers.pop(client, None)
+        if timer is not None:
+            timer.cancel()
+    
+    def client_disconnected(self, client):
+        """Forget a connection; its claims go once the client stays away (called on the loop)"""
+        if not client:
+            return
+        self.client_presence[client] -= 1
+        if self.client_presence[client] <= 0:
+            del self.client_presence[client]
+            # Long enough to ride out a page reload or an EventSource retry
+            self.release_timers[client] = self.loop.call_later(
+                self.claim_grace, self.drop_client, client)
+    
+    def client_claimed(self, client):
+        """A client took a claim; one with no open connection loses it after claim_grace"""
+        if client not in self.client_presence and client not in self.release_timers:
+            self.release_timers[client] = self.loop.call_later(
+                self.claim_grace, self.drop_client, client)
+    
+    def drop_client(self, client):
+        """Release the claims of a client that has not come back"""
+        self.release_timers.pop(client, None)
+        if client in self.client_presence or self.station is None:
+            return
+        released = self.station.sessions.release_client(client)
+        for session in released:
+            print(f"🎮 Client {client} left; session {session.id} is free to claim")
+        if released:
+            self.publish_status()
+    
+    def may_control(self, client):
+        """Whether input from this client may drive the app"""
+        return self.station is None or self.station.sessions.may_control(client)
+    
+    def get_quality_controller(self, client_id):
+        """Return the adaptive quality controller of a polling client"""
+        now = time.monotonic()
+        for stale in [key for key, controller in self.quality_controllers.items()
+                      if now - controller.last_seen > self.controller_ttl]:
+            del self.quality_controllers[stale]
+        
+        controller = self.quality_controllers.get(client_id)
+        if controller is None:
+            controller = AdaptiveQualityController(
+                1.0 / self.capture_service.fps, len(self.capture_service.ladder))
+            self.quality_controllers[client_id] = controller
+        return controller
+    
+    def build_status(self):
+        """Current station status as a JSON-ready dict"""
+        station = self.station
+        if station is None:
+            return {
+                'usb': {'connected': False, 'device_name': None, 'queue': 0},
+                'session': {'active': False, 'remaining': 0},
+                'sessions': [],
+                'max_sessions': 0
+            }
+        
+        sessions = [session.to_dict() for session in station.sessions.snapshot()]
+        
+        # The summary fields describe the oldest session
+        first = sessions[0] if sessions else None
+        return {
+            'usb': {
+                'connected': first is not None,
+                'device_name': first['device'] if first else None,
+                'queue': len(station.device_queue)
+            },
+            'session': {
+                'active': first is not None,
+                'remaining': first['remaining'] if first else 0
+            },
+            'sessions': sessions,
+            'max_sessions': station.sessions.max_sessions
+        }
+    
+    def publish_status(self):
+        """Rebuild the status snapshot and wake event subscribers if it changed (loop thread)"""
+        status = self.build_status()
+        snapshot = json.dumps(status, sort_keys=True)
+        if self.status_body is not None and snapshot == self.status_snapshot:
+            return
+        
+        self.status_snapshot = snapshot
+        self.status_version += 1
+        status['version'] = self.status_version
+        data = json.dumps(status)
+        self.status_body = data.encode()
+        self.status_message = f"id: {self.status_version}\nevent: status\ndata: {data}\n\n".encode()
+        
+        event, self.status_event = self.status_event, asyncio.Event()
+        if event is not None:
+            event.set()
+    
+    def notify_status(self):
+        """Publish a new status snapshot soon; safe to call from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self.publish_status)
+        except RuntimeError:
+            pass  # loop already closed
+    
+    async def status_ticker(self):
+        """Republish once a second so session countdowns stay current"""
+        while True:
+            try:
+                self.publish_status()
+            except Exception as e:
+                print(f"Status error: {e}")
+            await asyncio.sleep(self.status_interval)
+    
+    def on_frame(self, frame):
+        """Capture service callback, called on the capture thread"""
+        try:
+            self.loop.call_soon_threadsafe(self.notify_frame)
+        except RuntimeError:
+            pass  # loop already closed
+    
+    def notify_frame(self):
+        """Wake every coroutine waiting for a new frame"""
+        event, self.frame_event = self.frame_event, asyncio.Event()
+        if event is not None:
+            event.set()
+    
+    async def wait_for_frame(self, after_seq=0, timeout=5):
+        """Wait for a fresh frame newer than after_seq without blocking the loop"""
+        deadline = self.loop.time() + timeout
+        while True:
+            frame = self.capture_service.request_frame()
+            if frame is not None and frame.seq > after_seq:
+                return frame
+            
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self.frame_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+    
+    def inject_click(self, x, y, width=None, height=None):
+        """Click at frame coordinates (runs on the input executor)
+        
+        When the client reports the size of the frame it clicked on, the
+        point is scaled to the window size, whatever ladder level it saw.
+        """
+        # Convert to screen coordinates if needed
+        bounds = self.get_app_bounds()
+        if width and height:
+            if bounds:
+                target_width, target_height = bounds[2] - bounds[0], bounds[3] - bounds[1]
+            else:
+                target_width, target_height = pyautogui.size()
+            x = round(x * target_width / width)
+            y = round(y * target_height / height)
+        if bounds:
+            x += bounds[0]
+            y += bounds[1]
+        
+        # Perform click
+        with INPUT_SECONDS.time(kind='click'):
+            pyautogui.click(x, y)
+        print(f"Click at ({x}, {y})")
+    
+    def inject_events(self, events):
+        """Apply a batch of input events in order (runs on the input executor)
+        
+        Runs of printable keys are typed with a single pyautogui.write call.
+        Returns a list of per-event errors.
+        """
+        errors = []
+        text = []
+        text_seqs = []
+        
+        def flush_text():
+            if not text:
+                return
+            try:
+                with INPUT_SECONDS.time(kind='text'):
+                    pyautogui.write(''.join(text))
+            except Exception as e:
+                errors.extend({'seq': seq, 'error': str(e)} for seq in text_seqs)
+            text.clear()
+            text_seqs.clear()
+        
+        for event in events:
+            kind = event.get('type')
+            key = event.get('key', '')
+            
+            if kind == 'key' and len(key) == 1:
+                text.append(key)
+                text_seqs.append(event.get('seq'))
+                continue
+            
+            flush_text()
+            try:
+                if kind == 'click':
+                    self.inject_click(event.get('x', 0), event.get('y', 0),
+                                      event.get('width'), event.get('height'))
+                elif kind == 'key':
+                    self.inject_key(key)
+                else:
+                    raise ValueError(f"Unknown event type: {kind}")
+            except Exception as e:
+                print(f"Input error: {e}")
+                errors.append({'seq': event.get('seq'), 'error': str(e)})
+        
+        flush_text()
+        return errors
+    
+    def inject_key(self, key):
+        """Type a key from the web interface (runs on the input executor)"""
+        with INPUT_SECONDS.time(kind='key'):
+            # Handle special keys
+            if key == 'Enter':
+                pyautogui.press('enter')
+            elif key == 'Backspace':
+                pyautogui.press('backspace')
+            elif key == 'Tab':
+                pyautogui.press('tab')
+            elif key == 'Escape':
+                pyautogui.press('escape')
+            elif len(key) == 1:
+                pyautogui.write(key)
+    
+    def get_app_bounds(self):
+        """Get the last known bounds of the target application window"""
+        return self.bounds_tracker.get()
+
+class WindowBoundsTracker:
+    """Caches the app window rectangle, refreshed by a low-rate background thread
+    
+    Readers never block on osascript. A rectangle that could not be refreshed
+    within the TTL is treated as unknown, which means capturing the whole screen.
+    """
+    
+    def __init__(self, program_name, refresh_interval=1.0, ttl=10.0):
+        self.program_name = program_name
+        self.refresh_interval = refresh_interval
+        self.ttl = ttl
+        self.bounds = None
+        self.updated_at = 0
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def add_listener(self, callback):
+        """Register a callback invoked with the new bounds whenever they change"""
+        self.listeners.append(callback)
+    
+    def start(self):
+        """Start refreshing in the background"""
+        if not self.program_name or self.thread:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """Stop the refresh thread"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=6)
+            self.thread = None
+    
+    def get(self):
+        """Return the cached bounds, or None if unknown or expired"""
+        with self.lock:
+            if time.monotonic() - self.updated_at <= self.ttl:
+                return self.bounds
+            return None
+    
+    def run(self):
+        """Refresh loop"""
+        while not self.stop_event.is_set():
+            self.refresh()
+            self.stop_event.wait(self.refresh_interval)
+    
+    def refresh(self):
+        """Query the window bounds once and notify listeners on change"""
+        bounds = self.query_bounds()
+        now = time.monotonic()
+        
+        with self.lock:
+            previous = self.bounds
+            if bounds is not None:
+                self.bounds = bounds
+                self.updated_at = now
+            elif now - self.updated_at > self.ttl:
+                self.bounds = None
+            changed = self.bounds != previous
+            current = self.bounds
+        
+        if changed:
+            for callback in self.listeners:
+                callback(current)
+    
+    def query_bounds(self):
+        """Ask System Events for the window rectangle (blocking)"""
+        try:
+            # Use AppleScript to get window bounds as "x, y, width, height"
+            script = f'''
+            tell application "System Events"
+                tell process "{self.program_name}"
+                    get {{position, size}} of window 1
+                end tell
+            end tell
+            '''
+            
+            result = subprocess.run(['osascript', '-e', script], 
+                                  capture_output=True, text=True, timeout=5)
+            
+            if result.returncode == 0:
+                values = [int(value) for value in result.stdout.strip().split(',')]
+                if len(values) == 4:
+                    x, y, width, height = values
+                    return (x, y, x + width, y + height)
+            
+        except Exception as e:
+            print(f"Error getting app bounds: {e}")
+        
+        return None
+
+class CapturedFrame:
+    """A single captured and encoded screen frame"""
+    
+    def __init__(self, seq, jpeg, image, tile_versions=None, keyframe_seq=0, fingerprint=None):
+        self.seq = seq
+        self.jpeg = jpeg
+        self.fingerprint = fingerprint
+        self.variants = {0: jpeg}
+        self.timings = {}
+        self.image = image
+        self.width = image.width
+        self.height = image.height
+        self.tile_versions = tile_versions
+        self.keyframe_seq = keyframe_seq
+        self.timestamp = time.monotonic()
+
+class TileDeltaTracker:
+    """Tracks which tiles of the screen changed in which frame
+    
+    Each tile carries the sequence number of the frame that last changed it,
+    so the tiles a client is missing since frame N are simply those with a
+    version above N, whatever N is. Only the previous frame is kept in memory.
+    """
+    
+    def __init__(self, tile_size=128, quality=85):
+        load_dependencies()
+        self.tile_size = tile_size
+        self.quality = quality
+        self.previous = None
+        self.size = None
+        self.columns = 0
+        self.rows = 0
+        self.versions = []
+        self.keyframe_seq = 0
+        self.tile_cache = {}
+        self.lock = threading.Lock()
+    
+    def reset(self):
+        """Forget the previous frame so the next one becomes a keyframe"""
+        with self.lock:
+            self.previous = None
+            self.tile_cache.clear()
+    
+    def update(self, seq, image):
+        """Diff image against the previous frame and stamp changed tiles with seq"""
+        current = np.asarray(image) if np is not None else image
+        
+        with self.lock:
+            if self.previous is None or self.size != image.size:
+                # New geometry (or first frame): every tile changes
+                self.size = image.size
+                self.columns = -(-image.width // self.tile_size)
+                self.rows = -(-image.height // self.tile_size)
+                self.versions = [seq] * (self.columns * self.rows)
+                self.keyframe_seq = seq
+                self.tile_cache.clear()
+            else:
+                for index in self.changed_tiles(self.previous, current):
+                    self.versions[index] = seq
+            
+            self.previous = current
+            return list(self.versions), self.keyframe_seq
+    
+    def changed_tiles(self, previous, current):
+        """Return flat indices of the tiles that differ between two frames"""
+        size = self.tile_size
+        
+        if np is not None:
+            # Vectorized: per-byte change mask folded into tile rows, then tile columns.
+            # Channels stay in the row axis; reducing over a 3-wide axis is slow.
+            height, width, channels = current.shape
+            changed = (previous != current).reshape(height, width * channels)
+            
+            padded = np.zeros((self.rows * size, width * channels), dtype=bool)
+            padded[:height] = changed
+            tile_rows = padded.reshape(self.rows, size, width * channels).any(axis=1)
+            
+            padded = np.zeros((self.rows, self.columns * size * channels), dtype=bool)
+            padded[:, :width * channels] = tile_rows
+            tiles = padded.reshape(self.rows, self.columns, size * channels).any(axis=2)
+            return np.flatnonzero(tiles).tolist()
+        
+        # Without NumPy, let Pillow compute one difference image and probe each tile
+        difference = ImageChops.difference(previous, current)
+        indices = []
+        for row in range(self.rows):
+            for column in range(self.columns):
+                box = (column * size, row * size,
+                       min((column + 1) * size, self.size[0]),
+                       min((row + 1) * size, self.size[1]))
+                if difference.crop(box).getbbox():
+                    indices.append(row * self.columns + column)
+        return indices
+    
+    def encode_tile(self, frame, index):
+        """JPEG-encode one tile of a frame, shared by every client that needs it"""
+        version = frame.tile_versions[index]
+        with self.lock:
+            cached = self.tile_cache.get(index)
+        if cached and cached[0] == version:
+            return cached[1]
+        
+        size = self.tile_size
+        row, column = divmod(index, -(-frame.width // size))
+        box = (column * size, row * size,
+               min((column + 1) * size, frame.width),
+               min((row + 1) * size, frame.height))
+        
+        img_buffer = io.BytesIO()
+        frame.image.crop(box).save(img_buffer, format='JPEG', quality=self.quality)
+        data = img_buffer.getvalue()
+        
+        with self.lock:
+            self.tile_cache[index] = (version, data)
+        return data
+    
+    def build_delta(self, frame, since):
+        """Build the update that brings a client from frame `since` to `frame`"""
+        delta = {
+            'seq': frame.seq,
+            'width': frame.width,
+            'height': frame.height,
+            'keyframe': False,
+            'tiles': []
+        }
+        
+        indices = []
+        if frame.tile_versions is not None and frame.keyframe_seq <= since <= frame.seq:
+            indices = [i for i, version in enumerate(frame.tile_versions) if version > since]
+        
+        # Unknown base, or most of the screen changed: the full frame is cheaper
+        if frame.tile_versions is None or since < frame.keyframe_seq or \
+                since > frame.seq or len(indices) * 2 > len(frame.tile_versions):
+            delta['keyframe'] = True
+            delta['tiles'].append([0, 0, base64.b64encode(frame.jpeg).decode()])
+            return delta
+        
+        columns = -(-frame.width // self.tile_size)
+        for index in indices:
+            row, column = divmod(index, columns)
+            data = self.encode_tile(frame, index)
+            delta['tiles'].append([column * self.tile_size, row * self.tile_size,
+                                   base64.b64encode(data).decode()])
+        return delta
+
+class AdaptiveQualityController:
+    """Chooses a quality ladder level for one client from its delivery times
+    
+    Throughput is estimated from how long each frame takes to reach the
+    client. The controller steps down as soon as the next frame would not
+    fit the frame interval, and only steps back up after a run of frames
+    that would have fit at the higher level with some headroom. A frame that
+    went out without any wait says nothing about the rate, so it only lets
+    the estimate creep up until the next level gets tried.
+    """
+    
+    upgrade_after = 5
+    headroom = 0.8
+    probe_growth = 1.05
+    
+    def __init__(self, frame_interval, levels):
+        self.frame_interval = frame_interval
+        self.levels = levels
+        self.level = 0
+        self.throughput = None
+        self.delivery_time = None
+        self.good_frames = 0
+        self.last_seen = time.monotonic()
+    
+    def record(self, size, seconds):
+        """Record one delivered frame of `size` bytes that took `seconds`"""
+        self.last_seen = time.monotonic()
+        seconds = max(seconds, 0.001)
+        rate = size / seconds
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            self.throughput = 0.7 * self.throughput + 0.3 * rate
+        if self.delivery_time is None:
+            self.delivery_time = seconds
+        else:
+            self.delivery_time = 0.7 * self.delivery_time + 0.3 * seconds
+    
+    def record_unblocked(self):
+        """Record a frame that was delivered without waiting on the link"""
+        self.last_seen = time.monotonic()
+        if self.throughput is not None:
+            self.throughput *= self.probe_growth
+        if self.delivery_time is not None:
+            self.delivery_time *= 0.7
+    
+    def select(self, level_sizes):
+        """Return the ladder level to use for the next frame"""
+        self.last_seen = time.monotonic()
+        if self.throughput is None or self.delivery_time is None:
+            return self.level
+        
+        budget = self.throughput * self.frame_interval * self.headroom
+        
+        # Too slow at the current level: drop straight to the best level that fits
+        if level_sizes[self.level] > budget or self.delivery_time > self.frame_interval:
+            self.good_frames = 0
+            target = self.level
+            while target < self.levels - 1 and level_sizes[target] > budget:
+                target += 1
+            if target == self.level:
+                target = min(self.level + 1, self.levels - 1)
+            if target != self.level:
+                # Judge the new level on its own delivery times
+                self.level = target
+                self.delivery_time = None
+            return self.level
+        
+        # Comfortably fast: climb one level after a sustained good run
+        if self.level > 0 and level_sizes[self.level - 1] <= budget * self.headroom:
+            self.good_frames += 1
+            if self.good_frames >= self.upgrade_after:
+                self.level -= 1
+                self.good_frames = 0
+        else:
+            self.good_frames = 0
+        return self.level
+
+class StripJpegEncoder:
+    """Resizes and JPEG-encodes frames in horizontal strips on a thread pool
+    
+    Pillow releases the GIL while resampling and compressing, so the strips
+    really run in parallel. Strips are encoded with identical tables and
+    stitched into one baseline JPEG with restart markers between them, so
+    clients still receive a single ordinary image.
+    """
+    
+    MCU_SIZE = 16  # 4:2:0 subsampling
+    
+    def __init__(self, workers=None):
+        load_dependencies()
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.executor = None
+        if self.workers > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='strip')
+    
+    def shutdown(self):
+        """Release the worker threads"""
+        if self.executor:
+            self.executor.shutdown(wait=False)
+    
+    def strip_bounds(self, height, align=1):
+        """Split `height` rows into at most `workers` strips of `align`-row multiples"""
+        step = -(-height // self.workers)
+        step = -(-step // align) * align
+        return [(top, min(top + step, height)) for top in range(0, height, step)]
+    
+    def resize(self, image, size):
+        """LANCZOS resize, one output strip per worker"""
+        width, height = size
+        if self.executor is None or height < self.workers * self.MCU_SIZE:
+            return image.resize(size, Image.Resampling.LANCZOS)
+        
+        scale = image.height / height
+        
+        def resize_strip(bounds):
+            top, bottom = bounds
+            # The source box is fractional; Pillow samples the filter support
+            # from outside the box, so strips join without seams
+            return image.resize((width, bottom - top), Image.Resampling.LANCZOS,
+                                box=(0, top * scale, image.width, bottom * scale))
+        
+        bounds = self.strip_bounds(height)
+        result = Image.new(image.mode, size)
+        for (top, _), strip in zip(bounds, self.executor.map(resize_strip, bounds)):
+            result.paste(strip, (0, top))
+        return result
+    
+    def encode(self, image, quality):
+        """Encode one JPEG, in parallel strips when the frame is big enough"""
+        bounds = self.strip_bounds(image.height, self.MCU_SIZE)
+        mcus_per_strip = -(-image.width // self.MCU_SIZE) * (bounds[0][1] // self.MCU_SIZE)
+        
+        if self.executor is None or len(bounds) < 2 or mcus_per_strip > 0xFFFF:
+            img_buffer = io.BytesIO()
+            image.save(img_buffer, format='JPEG', quality=quality, optimize=True)
+            return img_buffer.getvalue()
+        
+        def encode_strip(strip_bounds):
+            top, bottom = strip_bounds
+            img_buffer = io.BytesIO()
+            image.crop((0, top, image.width, bottom)).save(
+                img_buffer, format='JPEG', quality=quality, subsampling='4:2:0')
+            return img_buffer.getvalue()
+        
+        strips = list(self.executor.map(encode_strip, bounds))
+        return self.stitch(strips, image.height, mcus_per_strip)
+    
+    @staticmethod
+    def split_jpeg(data):
+        """Return (headers up to and including SOS, entropy-coded scan data)"""
+        pos = 2  # Skip SOI
+        while True:
+            if data[pos] != 0xFF:
+                raise ValueError("Malformed JPEG segment")
+            marker = data[pos + 1]
+            length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+            end = pos + 2 + length
+            if marker == 0xDA:
+                return data[:end], data[end:-2]  # Drop EOI
+            pos = end
+    
+    def stitch(self, strips, height, restart_interval):
+        """Join strip JPEGs into one image, separated by RSTn markers"""
+        header, _ = self.split_jpeg(strips[0])
+        header = bytearray(header)
+        
+        # Patch the frame height in SOF0 and add DRI just before SOS
+        pos = 2
+        while header[pos + 1] != 0xDA:
+            length = struct.unpack('>H', header[pos + 2:pos + 4])[0]
+            if header[pos + 1] == 0xC0:
+                header[pos + 5:pos + 7] = struct.pack('>H', height)
+            pos += 2 + length
+        header[pos:pos] = b'\xff\xdd\x00\x04' + struct.pack('>H', restart_interval)
+        
+        parts = [bytes(header)]
+        for index, strip in enumerate(strips):
+            if index:
+                parts.append(bytes((0xFF, 0xD0 + (index - 1) % 8)))
+            parts.append(self.split_jpeg(strip)[1])
+        parts.append(b'\xff\xd9')
+        return b''.join(parts)
+
+class ScreenCaptureService:
+    """Background producer that captures and encodes one shared frame per tick"""
+    
+    LADDER = [(1280, 75), (960, 65), (640, 50)]
+    
+    def __init__(self, bounds_provider=None, fps=2, max_width=1920, quality=85,
+                 idle_timeout=10, encode_threads=None, frame_source=None):
+        load_dependencies()
+        self.bounds_provider = bounds_provider
+        self.frame_source = frame_source
+        self.encoder = StripJpegEncoder(encode_threads)
+        self.last_timings = {}
+        self.fps = fps
+        self.max_width = max_width
+        self.quality = quality
+        self.idle_timeout = idle_timeout
+        self.latest_frame = None
+        self.frame_seq = 0
+        self.last_demand = 0
+        self.condition = threading.Condition()
+        self.delta_tracker = TileDeltaTracker(quality=quality)
+        
+        # Recently encoded frames by fingerprint, so returning screens are free
+        self.fingerprint_factor = 4
+        self.encoded_cache = OrderedDict()
+        self.encoded_cache_size = 8
+        self.invalidated = False
+        
+        # Quality ladder as (width, JPEG quality); level 0 is the full frame
+        self.ladder = [(max_width, quality)] + [
+            (width, level_quality) for width, level_quality in self.LADDER
+            if width < max_width
+        ]
+        self.level_sizes = {}
+        self.level_demand = {}
+        self.listeners = []
+        self.is_running = False
+        self.thread = None
+    
+    def add_listener(self, callback):
+        """Register a callback invoked (on the capture thread) for each new frame
+        
+        It is also invoked with the latest frame when an unchanged capture
+        confirms that frame is current again.
+        """
+        self.listeners.append(callback)
+    
+    def start(self):
+        """Start the capture thread"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        print(f"🎥 Capture service started ({self.fps} FPS, {self.encoder.workers} encode threads)")
+    
+    def stop(self):
+        """Stop the capture thread"""
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        self.encoder.shutdown()
+    
+    def capture_frame(self):
+        """Grab the app window (or the entire screen) as an image"""
+        if self.frame_source:
+            return self.frame_source()
+        
+        bounds = self.bounds_provider() if self.bounds_provider else None
+        
+        if bounds:
+            # Capture specific app window
+            return ImageGrab.grab(bbox=bounds)
+        
+        # Capture entire screen
+        return ImageGrab.grab()
+    
+    def resize_frame(self, screenshot):
+        """Scale a captured image down to the streaming width"""
+        if screenshot.mode != 'RGB':
+            screenshot = screenshot.convert('RGB')
+        
+        # Resize for performance
+        if screenshot.width > self.max_width:
+            ratio = self.max_width / screenshot.width
+            new_height = int(screenshot.height * ratio)
+            screenshot = self.encoder.resize(screenshot, (self.max_width, new_height))
+        return screenshot
+    
+    def encode_frame(self, image):
+        """JPEG-encode a resized image"""
+        return self.encoder.encode(image, self.quality)
+    
+    def fingerprint_frame(self, image):
+        """Cheap content hash of a raw capture, taken from a downsampled copy
+        
+        The reduction grows with the capture size, so a 5K screen is sampled
+        at about the same cost as one already at the streaming width.
+        """
+        factor = self.fingerprint_factor * max(1, image.width // self.max_width)
+        sample = image.reduce(factor)
+        digest = hashlib.blake2b(sample.tobytes(), digest_size=16)
+        digest.update(f"{image.width}x{image.height}{image.mode}".encode())
+        return digest.hexdigest()
+    
+    def produce_frame(self):
+        """Capture, encode and publish one frame into the latest-frame slot"""
+        if self.invalidated:
+            self.invalidated = False
+            self.delta_tracker.reset()
+            self.encoded_cache.clear()
+        
+        timings = {}
+        started = time.perf_counter()
+        screenshot = self.capture_frame()
+        timings['capture'] = time.perf_counter() - started
+        
+        # Fingerprint before resizing, so an idle screen skips the resize too
+        started = time.perf_counter()
+        fingerprint = self.fingerprint_frame(screenshot)
+        timings['fingerprint'] = time.perf_counter() - started
+        self.last_timings = timings
+        
+        with self.condition:
+            latest = self.latest_frame
+            unchanged = latest is not None and latest.fingerprint == fingerprint
+            if unchanged:
+                # Unchanged screen: no encode, no new frame, just mark it current
+                latest.timestamp = time.monotonic()
+        if unchanged:
+            self.record_metrics(timings, 'unchanged')
+            # Waiters that found the frame stale can have it now
+            for callback in self.listeners:
+                callback(latest)
+            return
+        
+        started = time.perf_counter()
+        image = self.resize_frame(screenshot)
+        timings['resize'] = time.perf_counter() - started
+        
+        jpeg = self.encoded_cache.get(fingerprint)
+        if jpeg is None:
+            started = time.perf_counter()
+            jpeg = self.encode_frame(image)
+            timings['encode'] = time.perf_counter() - started
+            self.record_level_size(0, len(jpeg))
+            self.encoded_cache[fingerprint] = jpeg
+            while len(self.encoded_cache) > self.encoded_cache_size:
+                self.encoded_cache.popitem(last=False)
+        else:
+            self.encoded_cache.move_to_end(fingerprint)
+        
+        # Only this thread advances frame_seq, so the diff can run unlocked
+        seq = self.frame_seq + 1
+        started = time.perf_counter()
+        tile_versions, keyframe_seq = self.delta_tracker.update(seq, image)
+        timings['delta'] = time.perf_counter() - started
+        frame = CapturedFrame(seq, jpeg, image, tile_versions, keyframe_seq, fingerprint)
+        frame.timings = timings
+        self.record_metrics(timings, 'published', len(jpeg))
         
-        function showKeyboard() {
-            // Focus on a hidden input to trigger mobile keyboard
-            const input = document.createElement('input');
-            input.style.opacity = '0';
-            input.style.position = 'absolute';
-            input.style.left = '-9999px';
-            document.body.appendChild(input);
-            input.focus();
-            setTimeout(() => document.body.removeChild(input), 1000);
-        }
+        # Pre-encode the ladder levels some client is currently using
+        now = time.monotonic()
+        for level, requested_at in list(self.level_demand.items()):
+            if level and now - requested_at < self.idle_timeout:
+                self.encode_variant(frame, level)
         
-        function resetConnection() {
-            location.reload();
-        }
+        with self.condition:
+            self.frame_seq = seq
+            self.latest_frame = frame
         
-        function toggleFullscreen() {
-            if (document.fullscreenElement) {
-                document.exitFullscreen();
-            } else {
-                document.documentElement.requestFullscreen();
-            }
-        }
+        for callback in self.listeners:
+            callback(frame)
+    
+    def record_metrics(self, timings, outcome, size=None):
+        """Export one frame's stage timings and size"""
+        FRAMES_TOTAL.inc(outcome=outcome)
+        for stage, seconds in timings.items():
+            FRAME_STAGE_SECONDS.observe(seconds, stage=stage)
+        if size is not None:
+            FRAME_BYTES.observe(size)
+    
+    def encode_variant(self, frame, level):
+        """Return the frame encoded at a ladder level, encoding it on first use"""
+        self.level_demand[level] = time.monotonic()
+        data = frame.variants.get(level)
+        if data is not None:
+            return data
         
-        // Initialize when page loads
-        window.addEventListener('load', init);
+        width, quality = self.ladder[level]
+        image = frame.image
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
         
-        // Handle visibility changes
-        document.addEventListener('visibilitychange', function() {
-            if (document.hidden) {
-                clearInterval(updateInterval);
-            } else {
-                startScreenUpdates();
-            }
-        });
-    </script>
-</body>
-</html>
-        '''
+        img_buffer = io.BytesIO()
+        image.save(img_buffer, format='JPEG', quality=quality)
+        data = img_buffer.getvalue()
         
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.send_header('Cache-Control', 'no-cache')
-        self.end_headers()
-        self.wfile.write(html.encode())
+        frame.variants[level] = data
+        self.record_level_size(level, len(data))
+        return data
     
-    def serve_screenshot_api(self):
-        """Capture and serve app screenshot"""
-        try:
-            # Get the app window bounds if available
-            if hasattr(self.server, 'get_app_bounds'):
-                bounds = self.server.get_app_bounds()
-            else:
-                bounds = None
-            
-            if bounds:
-                # Capture specific app window
-                screenshot = ImageGrab.grab(bbox=bounds)
-            else:
-                # Capture entire screen
-                screenshot = ImageGrab.grab()
-            
-            # Resize for performance
-            max_width = 1920
-            if screenshot.width > max_width:
-                ratio = max_width / screenshot.width
-                new_height = int(screenshot.height * ratio)
-                screenshot = screenshot.resize((max_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Convert to bytes
-            img_buffer = io.BytesIO()
-            screenshot.save(img_buffer, format='JPEG', quality=85, optimize=True)
-            img_bytes = img_buffer.getvalue()
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'image/jpeg')
-            self.send_header('Cache-Control', 'no-cache')
-            self.send_header('Content-Length', len(img_bytes))
-            self.end_headers()
-            self.wfile.write(img_bytes)
-            
-        except Exception as e:
-            print(f"Screenshot error: {e}")
-            self.send_error(500)
+    def record_level_size(self, level, size):
+        """Track a moving average of encoded size per ladder level"""
+        previous = self.level_sizes.get(level)
+        self.level_sizes[level] = size if previous is None else 0.7 * previous + 0.3 * size
     
-    def handle_click(self):
-        """Handle mouse click from web interface"""
-        try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 0:
-                post_data = self.rfile.read(content_length)
-                data = json.loads(post_data.decode())
-                
-                x = data.get('x', 0)
-                y = data.get('y', 0)
-                
-                # Convert to screen coordinates if needed
-                if hasattr(self.server, 'get_app_bounds'):
-                    bounds = self.server.get_app_bounds()
-                    if bounds:
-                        x += bounds[0]
-                        y += bounds[1]
-                
-                # Perform click
-                pyautogui.click(x, y)
-                print(f"Click at ({x}, {y})")
-                
-                response = {'success': True}
-            else:
-                response = {'success': False, 'error': 'No data'}
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
-            
-        except Exception as e:
-            print(f"Click error: {e}")
-            response = {'success': False, 'error': str(e)}
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
+    def estimate_level_sizes(self):
+        """Expected bytes per frame for every ladder level"""
+        base = self.level_sizes.get(0) or 200000
+        estimates = []
+        for level, (width, _) in enumerate(self.ladder):
+            size = self.level_sizes.get(level)
+            if size is None:
+                # Not seen yet: assume size scales with pixel count
+                size = base * (width / self.ladder[0][0]) ** 2
+            estimates.append(size)
+        return estimates
     
-    def handle_key(self):
-        """Handle keyboard input from web interface"""
-        try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 0:
-                post_data = self.rfile.read(content_length)
-                data = json.loads(post_data.decode())
-                
-                key = data.get('key', '')
-                
-                # Handle special keys
-                if key == 'Enter':
-                    pyautogui.press('enter')
-                elif key == 'Backspace':
-                    pyautogui.press('backspace')
-                elif key == 'Tab':
-                    pyautogui.press('tab')
-                elif key == 'Escape':
-                    pyautogui.press('escape')
-                elif len(key) == 1:
-                    pyautogui.write(key)
-                
-                response = {'success': True}
-            else:
-                response = {'success': False, 'error': 'No data'}
+    def invalidate(self):
+        """Drop state derived from earlier frames (e.g. after the window moved)
+        
+        Called from other threads; the capture thread owns the cache and the
+        delta tracker, so it does the reset before its next frame.
+        """
+        self.invalidated = True
+    
+    def has_demand(self):
+        """Whether any viewer asked for a frame recently"""
+        return time.monotonic() - self.last_demand < self.idle_timeout
+    
+    def run(self):
+        """Capture loop: one capture/encode cycle per tick while viewers are watching"""
+        interval = 1.0 / self.fps
+        
+        while self.is_running:
+            # Sleep until a viewer shows up instead of capturing for nobody
+            with self.condition:
+                while self.is_running and not self.has_demand():
+                    self.condition.wait()
+            if not self.is_running:
+                break
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
+            started = time.monotonic()
+            try:
+                self.produce_frame()
+            except Exception as e:
+                print(f"Screenshot error: {e}")
+                FRAMES_TOTAL.inc(outcome='error')
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.is_running, timeout=1)
+                continue
             
-        except Exception as e:
-            print(f"Key error: {e}")
-            response = {'success': False, 'error': str(e)}
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
+            remaining = interval - (time.monotonic() - started)
+            if remaining > 0:
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.is_running, timeout=remaining)
     
-    def serve_status_api(self):
-        """Serve status information"""
-        try:
-            if hasattr(self.server, 'station'):
-                station = self.server.station
-                
-                # USB status
-                usb_status = {
-                    'connected': station.current_device is not None,
-                    'device_name': station.current_device.get('description', 'Unknown') if station.current_device else None,
-                    'queue': station.device_queue.qsize()
-                }
-                
-                # Session status
-                session_status = {
-                    'active': station.session_start_time is not None,
-                    'remaining': 0
-                }
-                
-                if station.session_start_time:
-                    elapsed = datetime.now() - station.session_start_time
-                    session_status['remaining'] = max(0, 60 - elapsed.seconds)
-                
-                status = {
-                    'usb': usb_status,
-                    'session': session_status
-                }
-            else:
-                status = {
-                    'usb': {'connected': False, 'device_name': None, 'queue': 0},
-                    'session': {'active': False, 'remaining': 0}
-                }
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(status).encode())
+    def request_frame(self):
+        """Register viewer demand and return the latest frame if it is still fresh"""
+        with self.condition:
+            if not self.has_demand():
+                # Wake the producer out of its idle wait
+                self.condition.notify_all()
+            self.last_demand = time.monotonic()
             
-        except Exception as e:
-            print(f"Status error: {e}")
-            self.send_error(500)
+            frame = self.latest_frame
+            if frame is not None and time.monotonic() - frame.timestamp <= 2.0 / self.fps:
+                return frame
+            return None
+
+def wait_until(predicate, timeout, interval=0.05, max_interval=0.5):
+    """Poll predicate with growing intervals until it is true or timeout passes"""
+    deadline = time.monotonic() + timeout
+    while True:
+        if predicate():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
+def port_open(host, port, timeout=0.5):
+    """Whether something accepts TCP connections on host:port"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+class DownloadError(Exception):
+    """A download that could not be completed or verified"""
 
-class WebDisplayServer(HTTPServer):
-    """Custom HTTP server for web display"""
+class ParallelDownloader:
+    """Ranged, resumable, checksum-verified HTTP downloads
     
-    def __init__(self, server_address, handler_class, station=None, program_name=None):
-        super().__init__(server_address, handler_class)
-        self.station = station
-        self.program_name = program_name
+    The file is fetched as several byte ranges in parallel into <dest>.part,
+    with progress kept in <dest>.part.json so an interrupted download picks
+    up where each range stopped. Only a verified file is renamed onto dest.
+    Servers without range support get a single plain stream.
+    """
     
-    def get_app_bounds(self):
-        """Get the bounds of the target application window"""
-        if not self.program_name:
-            return None
+    chunk_size = 256 * 1024
+    timeout = 30
+    
+    def __init__(self, parts=4, progress_interval=1.0):
+        self.parts = max(1, parts)
+        self.progress_interval = progress_interval
+    
+    def probe(self, url):
+        """Return (size, validator, accepts_ranges) from a HEAD request"""
+        request = urllib.request.Request(url, method='HEAD')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            size = int(response.headers.get('Content-Length') or -1)
+            validator = response.headers.get('ETag') or response.headers.get('Last-Modified') or ''
+            ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        return size, validator, ranges and size > 0
+    
+    def download(self, url, dest, sha256=None):
+        """Download url to dest and return its SHA-256; raises DownloadError"""
+        temp_path = dest + '.part'
+        state_path = temp_path + '.json'
         
         try:
-            # Use AppleScript to get window bounds
-            script = f'''
-            tell application "System Events"
-                tell process "{self.program_name}"
-                    get the position of window 1
-                    get the size of window 1
-                end tell
-            end tell
-            '''
-            
-            result = subprocess.run(['osascript', '-e', script], 
-                                  capture_output=True, text=True, timeout=5)
-            
-            if result.returncode == 0:
-                lines = result.stdout.strip().split('\\n')
-                if len(lines) >= 2:
-                    pos = lines[0].split(', ')
-                    size = lines[1].split(', ')
-                    
-                    x = int(pos[0])
-                    y = int(pos[1])
-                    width = int(size[0])
-                    height = int(size[1])
-                    
-                    return (x, y, x + width, y + height)
-            
+            size, validator, ranged = self.probe(url)
         except Exception as e:
-            print(f"Error getting app bounds: {e}")
+            raise DownloadError(f"Cannot reach {url}: {e}")
         
-        return None
+        if ranged:
+            self.fetch_ranges(url, temp_path, state_path, size, validator)
+        else:
+            self.fetch_stream(url, temp_path)
+        
+        digest = self.file_sha256(temp_path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        if sha256 and digest != sha256.lower():
+            os.remove(temp_path)
+            raise DownloadError(f"Checksum mismatch for {url}: expected {sha256}, got {digest}")
+        
+        os.replace(temp_path, dest)
+        return digest
+    
+    def load_ranges(self, temp_path, state_path, size, validator):
+        """Resume saved ranges if they belong to the same remote file, else plan new ones"""
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+            if state['size'] == size and state['validator'] == validator and \
+                    os.path.getsize(temp_path) == size:
+                return state['ranges']
+        except (OSError, ValueError, KeyError):
+            pass
+        
+        with open(temp_path, 'wb') as f:
+            f.truncate(size)
+        step = -(-size // self.parts)
+        return [[start, min(start + step, size), 0] for start in range(0, size, step)]
+    
+    def fetch_ranges(self, url, temp_path, state_path, size, validator):
+        """Fetch all unfinished ranges in parallel, saving progress as they go"""
+        ranges = self.load_ranges(temp_path, state_path, size, validator)
+        resumed = sum(done for _, _, done in ranges)
+        if resumed:
+            print(f"⏯️ Resuming download at {resumed * 100 // size}%")
+        
+        lock = threading.Lock()
+        
+        def save():
+            with lock:
+                snapshot = json.dumps({'size': size, 'validator': validator, 'ranges': ranges})
+            with open(state_path + '.tmp', 'w') as f:
+                f.write(snapshot)
+            os.replace(state_path + '.tmp', state_path)
+        
+        def fetch(part):
+            start, end, done = part
+            if start + done >= end:
+                return
+            request = urllib.request.Request(url, headers={'Range': f'bytes={start + done}-{end - 1}'})
+            if validator:
+                request.add_header('If-Range', validator)
+            with urllib.request.urlopen(request, timeout=self.timeout) as response, \
+                    open(temp_path, 'r+b') as f:
+                if response.status != 206:
+                    raise DownloadError("Server ignored the byte range (file changed?)")
+                f.seek(start + done)
+                for chunk in iter(lambda: response.read(self.chunk_size), b''):
+                    f.write(chunk)
+                    with lock:
+                        part[2] += len(chunk)
+            if part[2] != end - start:
+                raise DownloadError(f"Range {start}-{end - 1} ended early")
+        
+        save()
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix='download') as executor:
+            futures = [executor.submit(fetch, part) for part in ranges]
+            while not all(future.done() for future in futures):
+                time.sleep(self.progress_interval)
+                save()
+                self.report(sum(part[2] for part in ranges), size, resumed, started)
+            save()
+            
+            errors = [future.exception() for future in futures if future.exception()]
+            if errors:
+                raise DownloadError(f"Download interrupted, will resume next time: {errors[0]}")
+    
+    def fetch_stream(self, url, temp_path):
+        """Plain single-connection download for servers without range support"""
+        with urllib.request.urlopen(url, timeout=self.timeout) as response, open(temp_path, 'wb') as f:
+            shutil.copyfileobj(response, f, self.chunk_size)
+    
+    def report(self, received, size, resumed, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        rate = (received - resumed) / elapsed / 1e6
+        print(f"📥 {received * 100 // size}% ({received / 1e6:.1f}/{size / 1e6:.1f} MB, {rate:.1f} MB/s)")
+    
+    @staticmethod
+    def file_sha256(path):
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
 
 class VirtualHereInstaller:
     """Handles VirtualHere client download and installation"""
     
-    def __init__(self):
+    def __init__(self, mirror=None, cache_dir=None, sha256=None, download_parts=4):
         self.client_dir = os.path.expanduser("~/VirtualHere")
         self.client_path = os.path.join(self.client_dir, "vhclientx64")
         
+        # A fleet of stations can share one mirror and/or one cache directory
+        self.mirror = mirror
+        self.cache_dir = cache_dir
+        self.sha256 = sha256
+        self.downloader = ParallelDownloader(download_parts)
+        
         # VirtualHere download URLs
         self.download_urls = {
             "Darwin": {  # macOS
@@ -736,16 +3488,26 @@ class VirtualHereInstaller:
             return False
         
         download_url = platform_urls[machine]
+        if self.mirror:
+            download_url = f"{self.mirror.rstrip('/')}/{download_url.rsplit('/', 1)[1]}"
         
         try:
             # Create directory
             os.makedirs(self.client_dir, exist_ok=True)
             
-            print(f"📥 Downloading VirtualHere client...")
-            print(f"🔗 URL: {download_url}")
-            
-            # Download file
-            urllib.request.urlretrieve(download_url, self.client_path)
+            expected = self.expected_digest(download_url)
+            if not self.copy_from_cache(download_url, expected):
+                print(f"📥 Downloading VirtualHere client...")
+                print(f"🔗 URL: {download_url}")
+                
+                digest = self.downloader.download(download_url, self.client_path, expected)
+                print(f"🔒 SHA-256: {digest}")
+                if expected:
+                    self.store_in_cache(download_url, digest)
+                elif self.cache_dir:
+                    # Others would trust the sidecar, so only verified binaries go in
+                    print("⚠️ Not caching an unverified download; pass --vh-sha256 "
+                          "or publish <binary>.sha256 on the mirror")
             
             # Make executable (Unix-like systems)
             if system in ["Darwin", "Linux"]:
@@ -758,6 +3520,69 @@ class VirtualHereInstaller:
             print(f"❌ Download failed: {e}")
             return False
     
+    def expected_digest(self, download_url):
+        """SHA-256 the download must have: --vh-sha256, else the mirror's <binary>.sha256, else None"""
+        if self.sha256:
+            return self.sha256.lower()
+        if not self.mirror:
+            return None
+        try:
+            with urllib.request.urlopen(download_url + '.sha256', timeout=10) as response:
+                digest = response.read(4096).decode().split()[0].lower()
+        except (OSError, ValueError, IndexError):
+            return None
+        if len(digest) == 64 and all(c in '0123456789abcdef' for c in digest):
+            print(f"🔒 Expected SHA-256 from mirror: {digest}")
+            return digest
+        return None
+    
+    def cache_paths(self, download_url):
+        name = download_url.rsplit('/', 1)[1]
+        path = os.path.join(self.cache_dir, name)
+        return path, path + '.sha256'
+    
+    def copy_from_cache(self, download_url, expected=None):
+        """Install from the shared cache if it holds a verified copy"""
+        if not self.cache_dir:
+            return False
+        path, sum_path = self.cache_paths(download_url)
+        try:
+            with open(sum_path) as f:
+                recorded = f.read().split()[0]
+        except (OSError, IndexError):
+            return False
+        if expected and recorded != expected:
+            return False
+        
+        temp_path = self.client_path + '.part'
+        try:
+            shutil.copyfile(path, temp_path)
+        except OSError:
+            return False
+        if ParallelDownloader.file_sha256(temp_path) != recorded:
+            os.remove(temp_path)
+            print("⚠️ Cached VirtualHere client is corrupt, downloading again")
+            return False
+        os.replace(temp_path, self.client_path)
+        print(f"📦 VirtualHere client copied from cache: {path}")
+        return True
+    
+    def store_in_cache(self, download_url, digest):
+        """Publish a verified download to the shared cache, atomically"""
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path, sum_path = self.cache_paths(download_url)
+            temp_suffix = f".{os.getpid()}.tmp"
+            shutil.copyfile(self.client_path, path + temp_suffix)
+            os.replace(path + temp_suffix, path)
+            with open(sum_path + temp_suffix, 'w') as f:
+                f.write(f"{digest}  {os.path.basename(path)}\n")
+            os.replace(sum_path + temp_suffix, sum_path)
+        except OSError as e:
+            print(f"⚠️ Could not update download cache: {e}")
+    
     def install(self):
         """Install VirtualHere client if not already present"""
         if self.is_installed():
@@ -767,8 +3592,8 @@ class VirtualHereInstaller:
         print("📦 VirtualHere client not found, downloading...")
         return self.download_client()
     
-    def start_client(self, background=True):
-        """Start VirtualHere client"""
+    def start_client(self, background=True, ready=None, timeout=15):
+        """Start VirtualHere client, returning once ready() is true (or it survives a moment)"""
         if not self.is_installed():
             print("❌ VirtualHere client not installed")
             return None
@@ -785,13 +3610,21 @@ class VirtualHereInstaller:
                 # Start in foreground
                 process = subprocess.Popen([self.client_path])
             
-            # Give it time to start
-            time.sleep(2)
+            # Wait for readiness, or for the process to die early
+            if ready is None:
+                wait_until(lambda: process.poll() is not None, 0.5)
+                up = process.poll() is None
+            else:
+                up = wait_until(lambda: process.poll() is not None or ready(), timeout) and \
+                    process.poll() is None
             
-            # Check if it's running
-            if process.poll() is None:
+            if up:
                 print("✅ VirtualHere client started")
                 return process
+            elif process.poll() is None:
+                print(f"❌ VirtualHere client not ready after {timeout}s")
+                process.terminate()
+                return None
             else:
                 stdout, stderr = process.communicate()
                 print(f"❌ VirtualHere client failed to start")
@@ -803,11 +3636,18 @@ class VirtualHereInstaller:
             print(f"❌ Failed to start VirtualHere client: {e}")
             return None
     
-    def stop_client(self):
-        """Stop VirtualHere client"""
+    def stop_client(self, process=None):
+        """Stop the VirtualHere client we started, or every running one"""
         try:
+            if process is not None:
+                # Only ours; another station on this machine may have its own
+                process.terminate()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
             # Kill VirtualHere processes
-            if platform.system() == "Darwin":
+            elif platform.system() == "Darwin":
                 subprocess.run(["pkill", "-f", "vhclient"], capture_output=True)
             elif platform.system() == "Linux":
                 subprocess.run(["pkill", "-f", "vhclient"], capture_output=True)
@@ -820,71 +3660,205 @@ class VirtualHereInstaller:
             print(f"❌ Error stopping VirtualHere client: {e}")
 
 class VirtualHereManager:
+    """Pipelined, thread-safe client for the VirtualHere client API"""
+    
+    # Commands whose reply spans several lines and ends with a blank line
+    MULTILINE_COMMANDS = ('LIST', 'GET CLIENT STATE', 'DEVICE INFO', 'SERVER INFO', 'HELP')
+    COMMAND_TIMEOUTS = {'LIST': 5, 'USE': 15, 'STOP USING': 10}
+    default_timeout = 5
+    recv_size = 65536
+    
     def __init__(self, server_host="localhost", server_port=7575):
         self.server_host = server_host
         self.server_port = server_port
         self.socket = None
         self.connected = False
-        self.devices = {}
-        self.current_device = None
-        self.device_queue = Queue()
-        self.session_start_time = None
+        
+        # Requests are written and queued under one lock so replies match them in order
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.scan_offset = 0
+        self.reader = None
         
     def connect(self):
         """Connect to VirtualHere client"""
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.server_host, self.server_port))
-            self.connected = True
-            print(f"✅ Connected to VirtualHere at {self.server_host}:{self.server_port}")
-            return True
+            sock = socket.create_connection((self.server_host, self.server_port), timeout=10)
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         except Exception as e:
             print(f"❌ Failed to connect to VirtualHere: {e}")
             return False
+        
+        with self.lock:
+            self.socket = sock
+            self.buffer = bytearray()
+            self.scan_offset = 0
+            self.connected = True
+        self.reader = threading.Thread(target=self.read_responses, args=(sock,), daemon=True)
+        self.reader.start()
+        print(f"✅ Connected to VirtualHere at {self.server_host}:{self.server_port}")
+        return True
     
     def disconnect(self):
         """Disconnect from VirtualHere client"""
-        if self.socket:
+        with self.lock:
+            sock, self.socket = self.socket, None
+            self.connected = False
+            self.fail_pending(ConnectionError("VirtualHere connection closed"))
+        
+        if sock:
             try:
-                self.socket.close()
-            except:
+                # shutdown() wakes the reader thread blocked in recv()
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
                 pass
-            self.connected = False
+            sock.close()
+            if self.reader and self.reader is not threading.current_thread():
+                self.reader.join(timeout=2)
             print("🔌 Disconnected from VirtualHere")
     
-    def send_command(self, command):
-        """Send command to VirtualHere client"""
-        if not self.connected:
-            return None
-            
+    def reconnect(self):
+        """Drop a stalled connection and open a fresh one"""
+        self.disconnect()
+        return self.connect()
+    
+    def fail_pending(self, error):
+        """Fail every outstanding request (call with the lock held)"""
+        while self.pending:
+            future, _, _, _ = self.pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+    
+    @classmethod
+    def command_name(cls, command):
+        return command.split(',', 1)[0].strip().upper()
+    
+    def submit(self, command):
+        """Send a command without waiting and return a Future for its reply"""
+        future = Future()
+        name = self.command_name(command)
+        multiline = name in self.MULTILINE_COMMANDS
+        
+        with self.lock:
+            if not self.connected:
+                future.set_exception(ConnectionError("Not connected to VirtualHere"))
+                return future
+            try:
+                # VirtualHere API expects commands ending with newline
+                self.socket.sendall(f"{command}\n".encode())
+            except OSError as e:
+                future.set_exception(e)
+                return future
+            self.pending.append((future, multiline, name, time.perf_counter()))
+        return future
+    
+    def send_command(self, command, timeout=None):
+        """Send command to VirtualHere client and wait for its reply"""
+        if timeout is None:
+            timeout = self.COMMAND_TIMEOUTS.get(self.command_name(command), self.default_timeout)
+        
         try:
-            # VirtualHere API expects commands ending with newline
-            self.socket.send(f"{command}\\n".encode())
-            
-            # Read response
-            response = b""
-            while True:
-                data = self.socket.recv(1024)
-                if not data:
-                    break
-                response += data
-                if b"\\n" in data:
-                    break
-            
-            return response.decode().strip()
-            
+            return self.submit(command).result(timeout)
+        except FutureTimeout:
+            # A reply that never came would hold up every later reply
+            print(f"❌ VirtualHere command timed out after {timeout}s: {command}")
+            self.reconnect()
+            return None
         except Exception as e:
             print(f"❌ Command error: {e}")
             return None
     
+    def pipeline(self, commands, timeout=None):
+        """Send several commands back to back and collect their replies in order"""
+        futures = [self.submit(command) for command in commands]
+        if timeout is None:
+            timeout = max((self.COMMAND_TIMEOUTS.get(self.command_name(c), self.default_timeout)
+                           for c in commands), default=self.default_timeout)
+        
+        deadline = time.monotonic() + timeout
+        replies = []
+        for command, future in zip(commands, futures):
+            try:
+                replies.append(future.result(max(0, deadline - time.monotonic())))
+            except FutureTimeout:
+                print(f"❌ VirtualHere command timed out after {timeout}s: {command}")
+                self.reconnect()
+                replies.extend([None] * (len(commands) - len(replies)))
+                break
+            except Exception as e:
+                print(f"❌ Command error: {e}")
+                replies.append(None)
+        return replies
+    
+    def read_responses(self, sock):
+        """Reader thread: split the byte stream into replies for pending requests"""
+        while True:
+            try:
+                data = sock.recv(self.recv_size)
+            except OSError:
+                data = b''
+            
+            with self.lock:
+                if self.socket is not sock:
+                    return
+                if not data:
+                    # The API may close right after a reply; the buffer is then the last one
+                    if self.pending and self.buffer.strip():
+                        self.resolve(self.buffer.decode(errors='replace').strip())
+                    self.buffer = bytearray()
+                    self.connected = False
+                    self.fail_pending(ConnectionError("VirtualHere closed the connection"))
+                    print("⚠️ VirtualHere connection lost")
+                    return
+                
+                self.buffer += data
+                while self.pending:
+                    response = self.next_response(self.pending[0][1])
+                    if response is None:
+                        break
+                    self.resolve(response)
+    
+    def next_response(self, multiline):
+        """Cut one complete reply off the front of the buffer, or return None"""
+        buffer = self.buffer
+        while True:
+            end = buffer.find(b'\n', self.scan_offset)
+            if end == -1:
+                return None
+            line = buffer[self.scan_offset:end].strip()
+            self.scan_offset = end + 1
+            
+            # Single-line replies end at the first newline, LIST output at a blank line
+            if not multiline or not line:
+                response = bytes(buffer[:end + 1])
+                del buffer[:end + 1]
+                self.scan_offset = 0
+                return response.decode(errors='replace').strip()
+    
+    def resolve(self, response):
+        """Complete the oldest pending request (call with the lock held)"""
+        future, _, name, started = self.pending.popleft()
+        VIRTUALHERE_COMMAND_SECONDS.observe(time.perf_counter() - started, command=name)
+        if not future.done():
+            future.set_result(response)
+    
     def list_devices(self):
-        """List available USB devices"""
+        """List available USB devices, or None if LIST got no reply"""
         response = self.send_command("LIST")
+        if response is None:
+            return None
+        return self.parse_devices(response)
+    
+    @staticmethod
+    def parse_devices(response):
+        """Parse LIST output into iOS device dicts"""
         if not response:
             return []
         
         devices = []
-        lines = response.split('\\n')
+        lines = response.splitlines()
         
         for line in lines:
             if line.strip() and not line.startswith('VirtualHere'):
@@ -909,30 +3883,505 @@ class VirtualHereManager:
         return devices
     
     def use_device(self, device_address):
-        """Connect to a USB device"""
-        response = self.send_command(f"USE,{device_address}")
-        success = response and "OK" in response
-        
-        if success:
-            print(f"📱 Connected to device: {device_address}")
-        else:
-            print(f"❌ Failed to connect to device: {device_address}")
-            
-        return success
+        """Connect to a USB device"""
+        response = self.send_command(f"USE,{device_address}")
+        success = response and "OK" in response
+        
+        if success:
+            print(f"📱 Connected to device: {device_address}")
+        else:
+            print(f"❌ Failed to connect to device: {device_address}")
+            
+        return success
+    
+    def stop_using_device(self, device_address):
+        """Disconnect from a USB device"""
+        response = self.send_command(f"STOP USING,{device_address}")
+        success = response and "OK" in response
+        
+        if success:
+            print(f"🔌 Disconnected from device: {device_address}")
+        else:
+            print(f"❌ Failed to disconnect from device: {device_address}")
+            
+        return success
+
+class VirtualHerePool:
+    """Persistent connections to several VirtualHere endpoints, queried concurrently"""
+    
+    reconnect_interval = 30
+    
+    def __init__(self, endpoints):
+        self.clients = OrderedDict(
+            (f"{host}:{port}", VirtualHereManager(host, port)) for host, port in endpoints)
+        self.device_endpoints = {}
+        self.endpoint_devices = {}
+        self.last_attempt = {}
+        self.loop = None
+        self.thread = None
+    
+    @property
+    def connected(self):
+        return any(client.connected for client in self.clients.values())
+    
+    def probe(self):
+        """Whether any endpoint is accepting connections yet"""
+        return any(port_open(client.server_host, client.server_port) for client in self.clients.values())
+    
+    def start_loop(self):
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name='virtualhere-pool',
+                                           daemon=True)
+            self.thread.start()
+    
+    def run(self, coro):
+        """Run a pool coroutine from a synchronous caller"""
+        self.start_loop()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+    
+    def connect(self):
+        """Connect to every endpoint; succeeds if at least one is reachable"""
+        return self.run(self.connect_all())
+    
+    async def connect_all(self):
+        loop = asyncio.get_running_loop()
+        names = list(self.clients)
+        now = time.monotonic()
+        for name in names:
+            self.last_attempt[name] = now
+        results = await asyncio.gather(
+            *(loop.run_in_executor(None, self.clients[name].connect) for name in names))
+        return any(results)
+    
+    async def reconnect_stale(self):
+        """Retry endpoints that are down, at most every reconnect_interval seconds"""
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        stale = [name for name, client in self.clients.items() if not client.connected and
+                 now - self.last_attempt.get(name, 0) >= self.reconnect_interval]
+        for name in stale:
+            self.last_attempt[name] = now
+        if stale:
+            await asyncio.gather(
+                *(loop.run_in_executor(None, self.clients[name].connect) for name in stale))
+    
+    def disconnect(self):
+        """Disconnect from every endpoint and stop the pool loop"""
+        for client in self.clients.values():
+            client.disconnect()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=2)
+            self.loop.close()
+            self.loop = None
+    
+    async def command(self, name, command, timeout=None):
+        """Send one command to one endpoint and await its reply"""
+        client = self.clients[name]
+        if timeout is None:
+            timeout = client.COMMAND_TIMEOUTS.get(client.command_name(command), client.default_timeout)
+        
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(client.submit(command)), timeout)
+        except asyncio.TimeoutError:
+            print(f"❌ VirtualHere command timed out after {timeout}s on {name}: {command}")
+            await asyncio.get_running_loop().run_in_executor(None, client.reconnect)
+        except Exception as e:
+            print(f"❌ Command error on {name}: {e}")
+        return None
+    
+    def list_devices(self):
+        """List iOS devices across all endpoints, or None if none answered"""
+        return self.run(self.list_all())
+    
+    async def list_all(self):
+        """Send LIST to every endpoint at once and merge the replies
+        
+        An endpoint that is down or did not answer keeps the devices it
+        listed last time, so a transient failure does not look like every
+        device on it being unplugged.
+        """
+        await self.reconnect_stale()
+        names = [name for name, client in self.clients.items() if client.connected]
+        responses = await asyncio.gather(*(self.command(name, "LIST") for name in names))
+        
+        answered = 0
+        for name, response in zip(names, responses):
+            if response is not None:
+                self.endpoint_devices[name] = VirtualHereManager.parse_devices(response)
+                answered += 1
+        if not answered:
+            return None
+        
+        devices = []
+        endpoints = {}
+        for name in self.clients:
+            for device in self.endpoint_devices.get(name, ()):
+                # Two endpoints can see the same hub; the first one listed owns the device
+                if device['full_address'] in endpoints:
+                    continue
+                device['endpoint'] = name
+                endpoints[device['full_address']] = name
+                devices.append(device)
+        
+        self.device_endpoints = endpoints
+        return devices
+    
+    def endpoint_for(self, device_address):
+        name = self.device_endpoints.get(device_address)
+        if name is None and len(self.clients) == 1:
+            name = next(iter(self.clients))
+        return name
+    
+    def use_device(self, device_address):
+        """Connect to a USB device through the endpoint that lists it"""
+        return self.run(self.device_command("USE", device_address, "📱 Connected to device"))
     
     def stop_using_device(self, device_address):
         """Disconnect from a USB device"""
-        response = self.send_command(f"STOP USING,{device_address}")
-        success = response and "OK" in response
+        return self.run(self.device_command("STOP USING", device_address, "🔌 Disconnected from device"))
+    
+    async def device_command(self, verb, device_address, message):
+        name = self.endpoint_for(device_address)
+        response = await self.command(name, f"{verb},{device_address}") if name else None
+        success = bool(response and "OK" in response)
         
         if success:
-            print(f"🔌 Disconnected from device: {device_address}")
+            print(f"{message}: {device_address} ({name})")
         else:
-            print(f"❌ Failed to disconnect from device: {device_address}")
-            
+            print(f"❌ {verb} failed for device: {device_address}")
+        
         return success
+    
+    async def use_devices(self, device_addresses):
+        """USE several devices concurrently, possibly on different endpoints"""
+        return await asyncio.gather(
+            *(self.device_command("USE", address, "📱 Connected to device") for address in device_addresses))
+
+class DeviceRegistry:
+    """Devices indexed by full_address, diffed poll by poll into events
+    
+    Listeners get (event, device, previous) for 'attached', 'detached' and
+    'in_use_changed'. The poll interval drops to min_interval after a change
+    and backs off towards max_interval while nothing happens.
+    """
+    
+    ATTACHED = 'attached'
+    DETACHED = 'detached'
+    IN_USE_CHANGED = 'in_use_changed'
+    
+    def __init__(self, min_interval=1.0, max_interval=15.0, backoff=1.5):
+        self.devices = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.wake_event = threading.Event()
+    
+    def add_listener(self, callback):
+        """Register a callback invoked with (event, device, previous) on each change"""
+        self.listeners.append(callback)
+    
+    def get(self, full_address):
+        with self.lock:
+            return self.devices.get(full_address)
+    
+    def snapshot(self):
+        with self.lock:
+            return list(self.devices.values())
+    
+    def update(self, devices):
+        """Diff one LIST result against the previous one and emit events"""
+        current = {device['full_address']: device for device in devices}
+        events = []
+        
+        with self.lock:
+            previous = self.devices
+            for address, device in current.items():
+                before = previous.get(address)
+                if before is None:
+                    events.append((self.ATTACHED, device, None))
+                elif before['in_use'] != device['in_use']:
+                    events.append((self.IN_USE_CHANGED, device, before))
+            for address, before in previous.items():
+                if address not in current:
+                    events.append((self.DETACHED, before, before))
+            self.devices = current
+            
+            if events:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.max_interval, self.interval * self.backoff)
+        
+        for event, device, before in events:
+            for callback in self.listeners:
+                callback(event, device, before)
+        return events
+    
+    def wake(self):
+        """Poll again right away, e.g. after we USE or release a device"""
+        with self.lock:
+            self.interval = self.min_interval
+        self.wake_event.set()
+    
+    def wait(self, timeout=None):
+        """Sleep until the next poll is due or wake() is called"""
+        self.wake_event.wait(self.interval if timeout is None else timeout)
+        self.wake_event.clear()
+
+class DeviceWaitQueue:
+    """FIFO of devices waiting for a session, unique by full_address
+    
+    Membership, push, pop and removal are O(1). Each entry keeps the absolute
+    index it was pushed at, so a position is that index minus the number of
+    entries popped from the front. Only a removal from the middle leaves gaps;
+    those indices are renumbered lazily on the next position lookup.
+    """
+    
+    def __init__(self):
+        self.entries = OrderedDict()  # full_address -> (device, absolute index)
+        self.lock = threading.Lock()
+        self.next_index = 0
+        self.base = 0
+        self.dirty = False
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __contains__(self, full_address):
+        return full_address in self.entries
+    
+    def push(self, device):
+        """Append a device; returns its 1-based position, or None if already queued"""
+        address = device['full_address']
+        with self.lock:
+            if address in self.entries:
+                return None
+            self.entries[address] = (device, self.next_index)
+            self.next_index += 1
+            return len(self.entries)
+    
+    def pop(self):
+        """Remove and return the device at the front, or None"""
+        with self.lock:
+            if not self.entries:
+                return None
+            _, (device, index) = self.entries.popitem(last=False)
+            self.base = index + 1
+            return device
+    
+    def remove(self, full_address):
+        """Drop a device wherever it is; returns whether it was queued"""
+        with self.lock:
+            entry = self.entries.pop(full_address, None)
+            if entry is None:
+                return False
+            if entry[1] == self.base:
+                self.base += 1  # Removing the front leaves no gap
+            elif self.entries:
+                self.dirty = True
+            if not self.entries:
+                self.base = self.next_index = 0
+                self.dirty = False
+            return True
+    
+    def position(self, full_address):
+        """1-based position of a queued device, or None"""
+        with self.lock:
+            entry = self.entries.get(full_address)
+            if entry is None:
+                return None
+            if self.dirty:
+                self.renumber()
+                entry = self.entries[full_address]
+            return entry[1] - self.base + 1
+    
+    def renumber(self):
+        """Close the gaps left by removals from the middle (call with the lock held)"""
+        for index, (address, (device, _)) in enumerate(self.entries.items()):
+            self.entries[address] = (device, index)
+        self.base = 0
+        self.next_index = len(self.entries)
+        self.dirty = False
+    
+    def snapshot(self):
+        """Queued devices in order"""
+        with self.lock:
+            return [device for device, _ in self.entries.values()]
+
+class DeviceSession:
+    """One device under test, its timer and the client controlling it"""
+    
+    def __init__(self, session_id, device, length):
+        self.id = session_id
+        self.device = device
+        self.length = length
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + length
+        self.started_wall = datetime.now()
+        self.controller = None
+    
+    @property
+    def full_address(self):
+        return self.device['full_address']
+    
+    def remaining(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(0, self.deadline - now)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'device': self.device.get('description', 'Unknown'),
+            'address': self.full_address,
+            'endpoint': self.device.get('endpoint'),
+            'started': self.started_wall.isoformat(timespec='seconds'),
+            'remaining': int(self.remaining()),
+            'controller': self.controller
+        }
+
+class SessionManager:
+    """Up to max_sessions concurrent device sessions, keyed by full_address
+    
+    Deadlines live in a min-heap on the monotonic clock. Ended sessions leave
+    their heap entries behind; those are skipped when they reach the top.
+    """
+    
+    def __init__(self, max_sessions=1, session_length=60):
+        self.max_sessions = max_sessions
+        self.session_length = session_length
+        self.sessions = OrderedDict()
+        self.reserved = 0  # Slots taken by a USE that has not finished yet
+        self.deadlines = []  # (deadline, session id, full_address)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+    
+    def __len__(self):
+        return len(self.sessions)
+    
+    def __contains__(self, full_address):
+        return full_address in self.sessions
+    
+    def has_capacity(self):
+        with self.lock:
+            return len(self.sessions) + self.reserved < self.max_sessions
+    
+    def reserve(self):
+        """Take a free slot ahead of a USE; False if every slot is taken
+        
+        The slot is handed over by start() or given back by cancel().
+        """
+        with self.lock:
+            if len(self.sessions) + self.reserved >= self.max_sessions:
+                return False
+            self.reserved += 1
+            return True
+    
+    def cancel(self):
+        """Give back a slot taken by reserve()"""
+        with self.lock:
+            self.reserved = max(0, self.reserved - 1)
+    
+    def start(self, device):
+        """Record a session for a device we are now using, in a reserved slot"""
+        with self.lock:
+            self.reserved = max(0, self.reserved - 1)
+            session = DeviceSession(next(self.ids), device, self.session_length)
+            self.sessions[device['full_address']] = session
+            heapq.heappush(self.deadlines, (session.deadline, session.id, session.full_address))
+            return session
+    
+    def end(self, full_address):
+        """Forget a session; returns it, or None if there was none"""
+        with self.lock:
+            return self.sessions.pop(full_address, None)
+    
+    def find(self, session_id):
+        with self.lock:
+            for session in self.sessions.values():
+                if session.id == session_id:
+                    return session
+        return None
+    
+    def is_live(self, entry):
+        """Whether a heap entry still belongs to a running session (call with the lock held)"""
+        session = self.sessions.get(entry[2])
+        return session is not None and session.id == entry[1]
+    
+    def expired(self):
+        """Sessions whose time is up"""
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                entry = heapq.heappop(self.deadlines)
+                if self.is_live(entry):
+                    due.append(self.sessions[entry[2]])
+        return due
+    
+    def next_deadline(self):
+        """Monotonic time of the earliest running session's end, or None"""
+        with self.lock:
+            while self.deadlines and not self.is_live(self.deadlines[0]):
+                heapq.heappop(self.deadlines)
+            return self.deadlines[0][0] if self.deadlines else None
+    
+    def claim(self, session_id, client):
+        """Make a client the controller of a session
+        
+        Returns (session, error); a session controlled by another client is not taken over.
+        """
+        with self.lock:
+            for session in self.sessions.values():
+                if session.id == session_id:
+                    if session.controller not in (None, client):
+                        return session, 'Session is controlled by another client'
+                    session.controller = client
+                    return session, None
+        return None, 'No such session'
+    
+    def release(self, session_id, client):
+        """Give up control of a session this client holds"""
+        with self.lock:
+            for session in self.sessions.values():
+                if session.id == session_id and session.controller == client:
+                    session.controller = None
+                    return True
+        return False
+    
+    def release_client(self, client):
+        """Give up every session a client controls; returns them"""
+        released = []
+        with self.lock:
+            for session in self.sessions.values():
+                if session.controller == client:
+                    session.controller = None
+                    released.append(session)
+        return released
+    
+    def may_control(self, client):
+        """Whether a client may send input
+        
+        Anyone may while no session is claimed; after that only controllers.
+        Input goes to the station's single app window, not to a session, so
+        the controllers of concurrent sessions all drive the same window.
+        """
+        with self.lock:
+            controllers = {session.controller for session in self.sessions.values()
+                           if session.controller}
+        return not controllers or client in controllers
+    
+    def snapshot(self):
+        """All sessions, oldest first"""
+        with self.lock:
+            return list(self.sessions.values())
 
 class ProgramDisplayManager:
+    launch_timeout = 15
+    
     def __init__(self, program_path):
         self.program_path = program_path
         self.program_process = None
@@ -949,23 +4398,26 @@ class ProgramDisplayManager:
             else:
                 self.program_process = subprocess.Popen([self.program_path])
             
-            # Wait for launch
-            time.sleep(3)
-            
             # Get program name
             program_name = os.path.basename(self.program_path).replace('.app', '')
             
+            # Wait for launch: ready once the app has a window
+            if not wait_until(lambda: self.has_window(program_name), self.launch_timeout, 0.1):
+                print(f"⚠️ No window from {program_name} after {self.launch_timeout}s, continuing")
+            
             # Make fullscreen and hide desktop
             applescript = f'''
             tell application "{program_name}"
                 activate
-                delay 1
             end tell
             
             tell application "System Events"
                 tell process "{program_name}"
                     set frontmost to true
-                    delay 0.5
+                    repeat 40 times
+                        if frontmost then exit repeat
+                        delay 0.05
+                    end repeat
                     try
                         keystroke "f" using {{control down, command down}}
                     on error
@@ -988,6 +4440,15 @@ class ProgramDisplayManager:
             print(f"❌ Error showing program: {e}")
             return False
     
+    def has_window(self, program_name):
+        """Whether the program has opened a window yet"""
+        script = f'tell application "System Events" to exists (window 1 of process "{program_name}")'
+        try:
+            result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+        return result.stdout.strip() == 'true'
+    
     def hide_program(self):
         """Hide program and restore desktop"""
         if not self.is_displayed:
@@ -1011,80 +4472,227 @@ class ProgramDisplayManager:
         except Exception as e:
             print(f"❌ Error hiding program: {e}")
 
+class ControlServer:
+    """Local Unix-domain socket answering status/stop/drain from live station state
+    
+    One JSON request per line, one JSON reply per line. The socket file is
+    only accessible to the user running the station.
+    """
+    
+    def __init__(self, path, station):
+        self.path = path
+        self.station = station
+        self.socket = None
+        self.thread = None
+    
+    def start(self):
+        """Bind the socket and start answering in the background"""
+        if not hasattr(socket, 'AF_UNIX'):
+            print("⚠️ Control socket not supported on this platform")
+            return True
+        
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            try:
+                control_request(self.path, 'ping', timeout=0.5)
+                print(f"❌ Another station is already running (control socket {self.path})")
+                return False
+            except OSError:
+                os.remove(self.path)  # Left behind by a station that died
+        
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self.socket.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        self.socket.listen(8)
+        
+        self.thread = threading.Thread(target=self.run, name='control', daemon=True)
+        self.thread.start()
+        print(f"🎛️ Control socket: {self.path}")
+        return True
+    
+    def stop(self):
+        """Stop answering and remove the socket file"""
+        sock, self.socket = self.socket, None
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+    
+    def run(self):
+        sock = self.socket
+        while self.socket is sock:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+    
+    def serve(self, conn):
+        """Answer requests on one control connection"""
+        with conn, conn.makefile('rwb') as stream:
+            for line in stream:
+                try:
+                    request = json.loads(line)
+                    reply = self.dispatch(request.get('command'))
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+                stream.write(json.dumps(reply).encode() + b"\n")
+                stream.flush()
+    
+    def dispatch(self, command):
+        station = self.station
+        if command == 'ping':
+            return {'ok': True}
+        if command == 'status':
+            return dict(station.control_status(), ok=True)
+        if command == 'drain':
+            station.drain()
+            return dict(station.control_status(), ok=True)
+        if command == 'stop':
+            # Reply first; stop() closes this socket
+            threading.Thread(target=station.stop, name='control-stop').start()
+            return {'ok': True, 'stopping': True}
+        return {'ok': False, 'error': f"Unknown command: {command}"}
+
+def control_request(path, command, timeout=2):
+    """Send one command to a running station's control socket and return its reply"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps({'command': command}).encode() + b"\n")
+        reply = b''
+        while not reply.endswith(b"\n"):
+            data = sock.recv(65536)
+            if not data:
+                raise ConnectionError("Station closed the control connection")
+            reply += data
+    return json.loads(reply)
+
 class USBTestingStation:
     def __init__(self, program_path, virtualhere_host="localhost", virtualhere_port=7575, 
-                 web_port=8080, auto_install=True):
-        self.vh_installer = VirtualHereInstaller()
-        self.vh_manager = VirtualHereManager(virtualhere_host, virtualhere_port)
+                 web_port=8080, auto_install=True, capture_fps=15, encode_threads=None, hubs=None,
+                 max_sessions=1, session_length=60, upload_dir=None, build_cache_gb=20,
+                 vh_mirror=None, vh_cache_dir=None, vh_sha256=None, control_socket=CONTROL_SOCKET):
+        self.vh_installer = VirtualHereInstaller(vh_mirror, vh_cache_dir, vh_sha256)
+        self.vh_manager = VirtualHerePool(hubs or [(virtualhere_host, virtualhere_port)])
         self.display_manager = ProgramDisplayManager(program_path)
-        self.current_device = None
-        self.device_queue = Queue()
-        self.session_start_time = None
+        self.sessions = SessionManager(max_sessions, session_length)
+        self.schedule_event = threading.Event()
+        self.device_queue = DeviceWaitQueue()
+        self.device_registry = DeviceRegistry()
+        self.device_registry.add_listener(self.on_device_event)
         self.is_running = False
         self.auto_install = auto_install
         self.vh_process = None
         self.web_port = web_port
         self.web_server = None
+        self.capture_fps = capture_fps
+        self.encode_threads = encode_threads
+        self.upload_dir = upload_dir
+        self.build_cache_gb = build_cache_gb
+        self.startup_timings = {}
+        self.started_at = None
+        self.draining = False
+        self.stopping = False
+        self.stop_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.control_server = ControlServer(control_socket, self) if control_socket else None
         self.program_name = os.path.basename(program_path).replace('.app', '')
         
+        METRICS.gauge('usbtool_device_queue_depth', 'Devices waiting for a session',
+                      callback=lambda: len(self.device_queue))
+        METRICS.gauge('usbtool_active_sessions', 'Device sessions in progress',
+                      callback=lambda: len(self.sessions))
+        
     def start(self):
         """Start the testing station"""
         print("🚀 Starting USB Testing Station with Web Interface...")
+        started = time.monotonic()
         
-        # Install and start VirtualHere client if needed
-        if self.auto_install:
-            print("📦 Setting up VirtualHere client...")
-            
-            if not self.vh_installer.install():
-                print("❌ Failed to install VirtualHere client")
-                return False
-            
-            # Start VirtualHere client
-            self.vh_process = self.vh_installer.start_client(background=True)
-            if not self.vh_process:
-                print("❌ Failed to start VirtualHere client")
-                return False
-            
-            # Wait for client to be ready
-            print("⏳ Waiting for VirtualHere client to initialize...")
-            time.sleep(5)
-        
-        # Connect to VirtualHere
-        if not self.vh_manager.connect():
-            print("❌ Cannot start without VirtualHere connection")
-            if self.vh_process:
-                self.vh_installer.stop_client()
+        # Claim the control socket first: if another station answers on it,
+        # leave before touching the VirtualHere client or the app it uses
+        if self.control_server and not self.run_stage('control', self.control_server.start):
             return False
         
-        # Show program
-        if not self.display_manager.show_program():
-            print("❌ Cannot start without program display")
-            self.vh_manager.disconnect()
-            if self.vh_process:
-                self.vh_installer.stop_client()
-            return False
+        # Independent stages start together; each returns once it is really ready
+        stages = {
+            'virtualhere': self.start_virtualhere,
+            'program': self.display_manager.show_program,
+            'web': self.start_web_server
+        }
+        with ThreadPoolExecutor(max_workers=len(stages), thread_name_prefix='startup') as executor:
+            futures = {name: executor.submit(self.run_stage, name, stage) for name, stage in stages.items()}
+            failed = [name for name, future in futures.items() if not future.result()]
         
-        # Start web server
-        if not self.start_web_server():
-            print("❌ Cannot start without web server")
+        if failed:
+            # stop() only undoes what this process started
+            print(f"❌ Cannot start without: {', '.join(failed)}")
             self.stop()
             return False
         
         # Start monitoring
         self.is_running = True
+        self.started_at = time.monotonic()
         self.monitor_thread = threading.Thread(target=self.monitor_devices, daemon=True)
         self.monitor_thread.start()
         
         self.session_thread = threading.Thread(target=self.manage_sessions, daemon=True)
         self.session_thread.start()
         
-        print("✅ Testing station started!")
+        print(f"✅ Testing station started in {time.monotonic() - started:.2f}s "
+              f"({', '.join(f'{name} {seconds:.2f}s' for name, seconds in self.startup_timings.items())})")
         print(f"🌐 Web interface: http://localhost:{self.web_port}")
         print("👀 Users can connect via web browser to see and control your app")
         print("📱 Waiting for USB device connections...")
         
         return True
     
+    def run_stage(self, name, stage):
+        """Run one startup stage, recording how long it took to become ready"""
+        started = time.perf_counter()
+        try:
+            ready = stage()
+        except Exception as e:
+            print(f"❌ Startup stage {name} failed: {e}")
+            ready = False
+        
+        seconds = time.perf_counter() - started
+        self.startup_timings[name] = seconds
+        STARTUP_STAGE_SECONDS.set(seconds, stage=name)
+        if ready:
+            print(f"⏱️ {name} ready in {seconds:.2f}s")
+        return ready
+    
+    def start_virtualhere(self):
+        """Install and start the VirtualHere client if needed, then connect to it"""
+        if self.auto_install:
+            print("📦 Setting up VirtualHere client...")
+            
+            if not self.vh_installer.install():
+                print("❌ Failed to install VirtualHere client")
+                return False
+            
+            # Ready as soon as its API port accepts connections
+            self.vh_process = self.vh_installer.start_client(background=True, ready=self.vh_manager.probe)
+            if not self.vh_process:
+                print("❌ Failed to start VirtualHere client")
+                return False
+        
+        if not self.vh_manager.connect():
+            print("❌ Cannot start without VirtualHere connection")
+            return False
+        return True
+    
     def start_web_server(self):
         """Start the web server for remote display"""
         try:
@@ -1095,9 +4703,16 @@ class USBTestingStation:
                 ('0.0.0.0', self.web_port), 
                 WebDisplayHandler,
                 station=self,
-                program_name=self.program_name
+                program_name=self.program_name,
+                capture_fps=self.capture_fps,
+                encode_threads=self.encode_threads,
+                upload_dir=self.upload_dir,
+                build_cache_bytes=int(self.build_cache_gb * 1024 ** 3)
             )
             
+            # Start the bounds tracker and shared frame producer
+            self.web_server.start_services()
+            
             # Start server in background thread
             self.web_server_thread = threading.Thread(
                 target=self.web_server.serve_forever, 
@@ -1116,6 +4731,7 @@ class USBTestingStation:
         """Stop the web server"""
         if self.web_server:
             try:
+                self.web_server.stop_services()
                 self.web_server.shutdown()
                 self.web_server.server_close()
                 print("🌐 Web server stopped")
@@ -1124,13 +4740,21 @@ class USBTestingStation:
     
     def stop(self):
         """Stop the testing station"""
+        with self.stop_lock:
+            if self.stopping:
+                return  # Ctrl+C, the control socket and draining can race here
+            self.stopping = True
         print("🛑 Stopping testing station...")
         
         self.is_running = False
+        self.device_registry.wake()
+        self.schedule_event.set()
+        if self.control_server:
+            self.control_server.stop()
         
-        # Disconnect current device
-        if self.current_device:
-            self.vh_manager.stop_using_device(self.current_device['full_address'])
+        # Release every device under test
+        for session in self.sessions.snapshot():
+            self.end_session(session.full_address)
         
         # Stop web server
         self.stop_web_server()
@@ -1143,121 +4767,754 @@ class USBTestingStation:
         
         # Stop VirtualHere client if we started it
         if self.vh_process:
-            self.vh_installer.stop_client()
+            self.vh_installer.stop_client(self.vh_process)
+            self.vh_process = None
         
         print("✅ Testing station stopped")
+        self.stopped.set()
     
     def monitor_devices(self):
-        """Monitor for new device connections"""
+        """Poll the device list into the registry, which reports changes as events"""
         while self.is_running:
             try:
-                devices = self.vh_manager.list_devices()
+                with DEVICE_POLL_SECONDS.time():
+                    devices = self.vh_manager.list_devices()
                 
-                # Find new iOS devices
-                for device in devices:
-                    if not device['in_use'] and device['full_address'] not in [d.get('full_address') for d in [self.current_device] if d]:
-                        print(f"📱 New iOS device detected: {device['description']}")
-                        
-                        if not self.current_device:
-                            self.connect_device(device)
-                        else:
-                            self.add_to_queue(device)
+                if devices is None:
+                    # A failed LIST says nothing about the devices; keep them
+                    self.device_registry.wait(self.device_registry.min_interval)
+                    continue
                 
-                time.sleep(5)  # Check every 5 seconds
+                self.device_registry.update(devices)
+                self.device_registry.wait()
                 
             except Exception as e:
                 print(f"❌ Monitor error: {e}")
                 time.sleep(10)
     
+    def on_device_event(self, event, device, previous):
+        """React to a device appearing, disappearing or changing hands"""
+        address = device['full_address']
+        in_session = address in self.sessions
+        
+        if event == DeviceRegistry.DETACHED:
+            print(f"📴 Device detached: {device['description']}")
+            if self.device_queue.remove(address):
+                self.status_changed()
+            if in_session:
+                self.end_session(address)
+            return
+        
+        if device['in_use'] or in_session:
+            return
+        
+        # A new device, or one another client (or our last session) let go of
+        if event == DeviceRegistry.ATTACHED:
+            print(f"📱 New iOS device detected: {device['description']}")
+        else:
+            print(f"📱 iOS device available: {device['description']}")
+        
+        # The session thread fills slots too, so the slot is reserved atomically
+        if not len(self.device_queue) and not self.draining and self.sessions.reserve():
+            self.connect_device(device)
+        else:
+            self.add_to_queue(device)
+    
     def connect_device(self, device):
-        """Connect to a device and start session"""
-        if self.vh_manager.use_device(device['full_address']):
-            self.current_device = device
-            self.session_start_time = datetime.now()
+        """Connect to a device and start session in a slot taken by sessions.reserve()"""
+        try:
+            connected = self.vh_manager.use_device(device['full_address'])
+        except Exception:
+            self.sessions.cancel()
+            raise
+        
+        if connected:
+            session = self.sessions.start(device)
+            SESSIONS_STARTED.inc()
             
-            print(f"🎯 Session started: {device['description']}")
-            print("⏰ 60 second session timer started")
+            print(f"🎯 Session {session.id} started: {device['description']} "
+                  f"({len(self.sessions)}/{self.sessions.max_sessions} active)")
+            print(f"⏰ {session.length} second session timer started")
+            self.schedule_event.set()
+            self.status_changed()
+        else:
+            self.sessions.cancel()
+    
+    def drain(self):
+        """Let running sessions finish, start no new ones, then stop"""
+        if not self.draining:
+            self.draining = True
+            print(f"🚰 Draining: waiting for {len(self.sessions)} session(s) to finish")
+            self.schedule_event.set()
+            self.status_changed()
+    
+    def control_status(self):
+        """Live station state for the control socket"""
+        return {
+            'pid': os.getpid(),
+            'version': VERSION,
+            'running': self.is_running,
+            'draining': self.draining,
+            'uptime': round(time.monotonic() - self.started_at, 1) if self.started_at else 0,
+            'web_port': self.web_port,
+            'program': self.program_name,
+            'sessions': [session.to_dict() for session in self.sessions.snapshot()],
+            'max_sessions': self.sessions.max_sessions,
+            'queue': [device.get('description') for device in self.device_queue.snapshot()],
+            'devices': len(self.device_registry.snapshot()),
+            'connections': len(self.web_server.connections) if self.web_server else 0,
+            'startup': {name: round(seconds, 3) for name, seconds in self.startup_timings.items()}
+        }
+    
+    def status_changed(self):
+        """Push a fresh status snapshot to connected browsers"""
+        if self.web_server:
+            self.web_server.notify_status()
     
     def add_to_queue(self, device):
         """Add device to queue"""
-        self.device_queue.put(device)
-        queue_size = self.device_queue.qsize()
-        print(f"⏳ Device queued: {device['description']} (Position: {queue_size})")
+        position = self.device_queue.push(device)
+        if position is not None:
+            print(f"⏳ Device queued: {device['description']} (Position: {position})")
+            self.schedule_event.set()
+            self.status_changed()
     
     def manage_sessions(self):
-        """Manage session timeouts and queue"""
+        """Expire sessions at their deadlines and fill free slots from the queue
+        
+        Sleeps until the next deadline; queue, session and device changes wake it early.
+        """
         while self.is_running:
             try:
-                # Check session timeout
-                if self.current_device and self.session_start_time:
-                    elapsed = datetime.now() - self.session_start_time
-                    
-                    if elapsed.seconds >= 60:  # 1 minute timeout
-                        print(f"⏰ Session timeout: {self.current_device['description']}")
-                        self.end_current_session()
+                self.schedule_event.clear()
                 
-                # Process queue
-                if not self.current_device and not self.device_queue.empty():
-                    next_device = self.device_queue.get()
+                # Check session timeouts
+                for session in self.sessions.expired():
+                    print(f"⏰ Session timeout: {session.device['description']}")
+                    self.end_session(session.full_address)
+                
+                # Draining: stop once the last session is over
+                if self.draining and not len(self.sessions):
+                    print("✅ Drained: no sessions left")
+                    self.stop()
+                    break
+                
+                # Fill free session slots from the queue
+                while not self.draining and self.sessions.reserve():
+                    next_device = self.device_queue.pop()
+                    if not next_device:
+                        self.sessions.cancel()
+                        break
                     print(f"📱 Processing queued device: {next_device['description']}")
                     self.connect_device(next_device)
                 
-                time.sleep(1)
+                deadline = self.sessions.next_deadline()
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                self.schedule_event.wait(timeout)
                 
             except Exception as e:
                 print(f"❌ Session management error: {e}")
                 time.sleep(5)
     
-    def end_current_session(self):
-        """End current device session"""
-        if self.current_device:
-            device_addr = self.current_device['full_address']
-            device_desc = self.current_device['description']
+    def end_session(self, full_address):
+        """End one device session"""
+        session = self.sessions.end(full_address)
+        if session:
+            self.vh_manager.stop_using_device(full_address)
+            
+            print(f"🔚 Session {session.id} ended: {session.device['description']}")
+            
+            self.device_registry.wake()
+            self.schedule_event.set()
+            self.status_changed()
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+class PipelineBenchmark:
+    """Headless benchmark of the capture -> resize -> encode -> serve pipeline
+    
+    Frames come from a synthetic UI generator or from recorded screenshots
+    instead of the screen, and go through the same ScreenCaptureService and
+    WebDisplayServer code as a live station. Each resolution/thread setting
+    runs in its own child process so its peak memory can be reported.
+    """
+    
+    RESOLUTIONS = {
+        '1080p': (1920, 1080),
+        '1440p': (2560, 1440),
+        '5k': (5120, 2880)
+    }
+    
+    def __init__(self, resolutions=('1080p', '1440p', '5k'), threads=(1, 0), viewers=(1, 10),
+                 seconds=5, fps=15, recorded_dir=None):
+        self.resolutions = resolutions
+        self.threads = threads
+        self.viewers = viewers
+        self.seconds = seconds
+        self.fps = fps
+        self.recorded_dir = recorded_dir
+    
+    def configurations(self):
+        """All (source, resolution, threads) combinations to run"""
+        sources = [('synthetic', name) for name in self.resolutions]
+        if self.recorded_dir:
+            sources.append(('recorded', self.recorded_dir))
+        
+        for (source, resolution), threads in itertools.product(sources, self.threads):
+            yield {
+                'source': source,
+                'resolution': resolution,
+                'encode_threads': threads or os.cpu_count() or 1,
+                'viewers': list(self.viewers),
+                'seconds': self.seconds,
+                'fps': self.fps
+            }
+    
+    def run(self):
+        """Run every configuration and return the JSON-ready report"""
+        load_dependencies()
+        results = []
+        context = multiprocessing.get_context('spawn')
+        
+        for config in self.configurations():
+            print(f"⏱️  {config['source']} {config['resolution']}, "
+                  f"{config['encode_threads']} encode threads...")
+            with context.Pool(1) as pool:
+                result = pool.apply(PipelineBenchmark.run_config, (config,))
+            results.append(result)
             
-            self.vh_manager.stop_using_device(device_addr)
+            pipeline = result['pipeline']
+            print(f"   {pipeline['fps']:.1f} FPS, p50 {pipeline['latency_ms']['p50']:.1f} ms, "
+                  f"p99 {pipeline['latency_ms']['p99']:.1f} ms, "
+                  f"{pipeline['bytes_per_frame'] / 1024:.0f} KiB/frame, "
+                  f"peak {result['peak_rss_bytes'] / 2 ** 20:.0f} MiB")
+        
+        return {
+            'version': VERSION,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'host': {
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'cpu_count': os.cpu_count(),
+                'pillow': Image.__version__,
+                'numpy': np.__version__ if np is not None else None
+            },
+            'results': results
+        }
+    
+    @staticmethod
+    def synthetic_frames(size, count=3):
+        """UI-like test screens: panels, text rows and a photo-like area"""
+        width, height = size
+        frames = []
+        for index in range(count):
+            image = Image.new('RGB', size, (28, 28, 30))
+            draw = ImageDraw.Draw(image)
+            draw.rectangle((0, 0, width, height // 14), fill=(45, 45, 50))
+            draw.rectangle((0, height // 14, width // 5, height), fill=(36, 36, 40))
+            for row in range(height // 14 + 20, height - 20, max(12, height // 45)):
+                indent = width // 5 + 40 + (row * 7 + index * 53) % 90
+                draw.text((indent, row), f"Item {row} - build {index}" * 3, fill=(220, 220, 220))
             
-            print(f"🔚 Session ended: {device_desc}")
+            # Noise patch standing in for photos and gradients
+            patch = (width // 3, height // 3)
+            noise = Image.frombytes('RGB', patch, os.urandom(patch[0] * patch[1] * 3))
+            image.paste(noise.resize((patch[0], patch[1]), Image.Resampling.BILINEAR),
+                        (width // 2, height // 3))
+            frames.append(image)
+        return frames
+    
+    @staticmethod
+    def recorded_frames(directory):
+        """Load recorded screenshots, scaled to the size of the first one"""
+        frames = []
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
+                image = Image.open(os.path.join(directory, name)).convert('RGB')
+                if frames and image.size != frames[0].size:
+                    image = image.resize(frames[0].size, Image.Resampling.LANCZOS)
+                frames.append(image)
+        if not frames:
+            raise ValueError(f"No recorded frames found in {directory}")
+        return frames
+    
+    @staticmethod
+    def frame_source(frames):
+        """Cycle through frames, stamping a counter so consecutive frames differ"""
+        counter = itertools.count()
+        
+        def next_frame():
+            index = next(counter)
+            image = frames[index % len(frames)].copy()
+            draw = ImageDraw.Draw(image)
+            draw.rectangle((10, 10, 210, 40), fill=(0, 0, 0))
+            draw.text((16, 18), f"frame {index}", fill=(255, 255, 255))
+            return image
+        return next_frame
+    
+    @staticmethod
+    def run_config(config):
+        """Benchmark one configuration (runs in a child process)"""
+        load_dependencies()
+        if config['source'] == 'recorded':
+            frames = PipelineBenchmark.recorded_frames(config['resolution'])
+        else:
+            frames = PipelineBenchmark.synthetic_frames(
+                PipelineBenchmark.RESOLUTIONS[config['resolution']])
+        source = PipelineBenchmark.frame_source(frames)
+        
+        result = dict(config)
+        result['width'], result['height'] = frames[0].size
+        result['pipeline'] = PipelineBenchmark.measure_pipeline(config, source)
+        result['serve'] = [PipelineBenchmark.measure_serving(config, source, viewers)
+                           for viewers in config['viewers']]
+        
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['peak_rss_bytes'] = peak if platform.system() == 'Darwin' else peak * 1024
+        return result
+    
+    @staticmethod
+    def measure_pipeline(config, source):
+        """Time produce_frame() back to back for the configured duration"""
+        service = ScreenCaptureService(fps=config['fps'], encode_threads=config['encode_threads'],
+                                       frame_source=source)
+        service.encoded_cache_size = 0  # Measure real encodes, not cache hits
+        
+        latencies = []
+        sizes = []
+        stages = {}
+        started = time.perf_counter()
+        deadline = started + config['seconds']
+        while time.perf_counter() < deadline:
+            tick = time.perf_counter()
+            service.produce_frame()
+            latencies.append(time.perf_counter() - tick)
+            sizes.append(len(service.latest_frame.jpeg))
+            for stage, seconds in service.last_timings.items():
+                stages.setdefault(stage, []).append(seconds)
+        elapsed = time.perf_counter() - started
+        service.encoder.shutdown()
+        
+        return {
+            'frames': len(latencies),
+            'fps': len(latencies) / elapsed,
+            'latency_ms': {
+                'mean': sum(latencies) / len(latencies) * 1000,
+                'p50': percentile(latencies, 50) * 1000,
+                'p99': percentile(latencies, 99) * 1000
+            },
+            'stages_ms': {stage: sum(values) / len(values) * 1000
+                          for stage, values in stages.items()},
+            'bytes_per_frame': sum(sizes) / len(sizes)
+        }
+    
+    @staticmethod
+    def measure_serving(config, source, viewers):
+        """Serve the stream to `viewers` local MJPEG clients and count deliveries"""
+        server = WebDisplayServer(('127.0.0.1', 0), WebDisplayHandler,
+                                  capture_fps=config['fps'],
+                                  encode_threads=config['encode_threads'])
+        server.capture_service.frame_source = source
+        port = server.socket.getsockname()[1]
+        server.capture_service.start()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        
+        try:
+            counts = asyncio.run(PipelineBenchmark.run_viewers(port, viewers, config['seconds']))
+        finally:
+            server.capture_service.stop()
+            server.shutdown()
+            server.server_close()
+        
+        frames = sum(frames for frames, _ in counts)
+        total_bytes = sum(size for _, size in counts)
+        return {
+            'viewers': viewers,
+            'target_fps': config['fps'],
+            'delivered_fps_per_viewer': frames / viewers / config['seconds'],
+            'bytes_per_sec': total_bytes / config['seconds']
+        }
+    
+    @staticmethod
+    async def run_viewers(port, viewers, seconds):
+        """Run concurrent MJPEG viewers, returning (frames, bytes) per viewer"""
+        async def viewer():
+            frames = received = 0
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b"GET /api/stream?level=0 HTTP/1.1\r\nHost: benchmark\r\n\r\n")
+            await reader.readuntil(b"\r\n\r\n")
             
-            self.current_device = None
-            self.session_start_time = None
+            deadline = asyncio.get_running_loop().time() + seconds
+            try:
+                while True:
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    if remaining <= 0:
+                        break
+                    part = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), remaining)
+                    headers = email.parser.BytesParser().parsebytes(part.split(b"\r\n", 1)[1])
+                    length = int(headers['Content-Length'])
+                    await asyncio.wait_for(reader.readexactly(length + 2), remaining)
+                    frames += 1
+                    received += length
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                writer.close()
+            return frames, received
+        
+        return await asyncio.gather(*(viewer() for _ in range(viewers)))
+
+class LoadGenerator:
+    """Simulates many browser testers against a running station
+    
+    Every simulated viewer follows the page's polling cadence: a conditional
+    screenshot request every 500 ms, a status request every 2 s and a random
+    click or key now and then. Each loop keeps its own keep-alive connection,
+    like a browser would.
+    """
+    
+    ENDPOINTS = ('screenshot', 'status', 'click', 'key')
+    
+    def __init__(self, target, viewers=10, duration=30, screenshot_interval=0.5,
+                 status_interval=2.0, input_interval=3.0, ramp_up=5.0):
+        url = urllib.parse.urlsplit(target if '://' in target else f"http://{target}")
+        self.host = url.hostname or 'localhost'
+        self.port = url.port or 80
+        self.viewers = viewers
+        self.duration = duration
+        self.screenshot_interval = screenshot_interval
+        self.status_interval = status_interval
+        self.input_interval = input_interval
+        self.ramp_up = min(ramp_up, duration / 2)
+        self.stats = {name: {'latencies': [], 'errors': 0, 'bytes': 0, 'statuses': {}}
+                      for name in self.ENDPOINTS}
+    
+    def run(self):
+        """Run the load test and return the JSON-ready report"""
+        print(f"🚦 {self.viewers} simulated viewers against {self.host}:{self.port} "
+              f"for {self.duration:.0f}s...")
+        started = time.monotonic()
+        asyncio.run(self.run_viewers())
+        return self.report(time.monotonic() - started)
+    
+    async def run_viewers(self):
+        """Start every viewer (staggered over the ramp-up) and wait for them"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.duration
+        
+        async def viewer(index):
+            await asyncio.sleep(self.ramp_up * index / max(1, self.viewers))
+            client_id = f"load-{index}"
+            tasks = [
+                self.screenshot_loop(client_id, deadline),
+                self.poll_loop('status', '/api/status', self.status_interval, deadline)
+            ]
+            if self.input_interval > 0:
+                tasks.append(self.input_loop(deadline))
+            await asyncio.gather(*tasks)
+        
+        await asyncio.gather(*(viewer(index) for index in range(self.viewers)))
+    
+    async def screenshot_loop(self, client_id, deadline):
+        """Poll screenshots like the page's fallback, revalidating with ETags"""
+        connection = [None, None]
+        etag = None
+        while asyncio.get_running_loop().time() < deadline:
+            headers = {'If-None-Match': etag} if etag else {}
+            response = await self.timed_request('screenshot', connection, 'GET',
+                                                f'/api/screenshot?client={client_id}',
+                                                headers=headers)
+            if response and response[0] == 200:
+                etag = response[1].get('ETag')
+            await asyncio.sleep(self.screenshot_interval)
+        self.close(connection)
+    
+    async def poll_loop(self, endpoint, path, interval, deadline):
+        """Request one endpoint at a fixed interval"""
+        connection = [None, None]
+        while asyncio.get_running_loop().time() < deadline:
+            await self.timed_request(endpoint, connection, 'GET', path)
+            await asyncio.sleep(interval)
+        self.close(connection)
+    
+    async def input_loop(self, deadline):
+        """Send random clicks and keys at roughly input_interval seconds apart"""
+        connection = [None, None]
+        while True:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.input_interval)
+            if asyncio.get_running_loop().time() >= deadline:
+                break
+            if random.random() < 0.5:
+                body = {'x': random.randint(0, 1919), 'y': random.randint(0, 1079),
+                        'width': 1920, 'height': 1080}
+                await self.timed_request('click', connection, 'POST', '/api/click', body)
+            else:
+                body = {'key': random.choice('abcdefghijklmnopqrstuvwxyz')}
+                await self.timed_request('key', connection, 'POST', '/api/key', body)
+        self.close(connection)
+    
+    async def timed_request(self, endpoint, connection, method, path, body=None, headers=None):
+        """Make one request, recording its latency, size and status"""
+        stats = self.stats[endpoint]
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self.request(connection, method, path, body, headers), 30)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            stats['errors'] += 1
+            key = type(e).__name__
+            stats['statuses'][key] = stats['statuses'].get(key, 0) + 1
+            self.close(connection)
+            return None
+        
+        status, _, data = response
+        stats['latencies'].append(time.perf_counter() - started)
+        stats['bytes'] += len(data)
+        stats['statuses'][str(status)] = stats['statuses'].get(str(status), 0) + 1
+        if status >= 400:
+            stats['errors'] += 1
+        return response
+    
+    async def request(self, connection, method, path, body=None, headers=None):
+        """Send one HTTP/1.1 request on a keep-alive connection"""
+        if connection[0] is None:
+            connection[0], connection[1] = await asyncio.open_connection(self.host, self.port)
+        reader, writer = connection
+        
+        payload = json.dumps(body).encode() if body is not None else b''
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                 f"Content-Length: {len(payload)}"]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines.extend(f"{key}: {value}" for key, value in (headers or {}).items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + payload)
+        await writer.drain()
+        
+        head = await reader.readuntil(b"\r\n\r\n")
+        status_line, _, header_text = head.decode('iso-8859-1').partition("\r\n")
+        status = int(status_line.split()[1])
+        response_headers = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(header_text)
+        data = await reader.readexactly(int(response_headers.get('Content-Length', 0)))
+        
+        if response_headers.get('Connection', '').lower() == 'close':
+            self.close(connection)
+        return status, response_headers, data
+    
+    @staticmethod
+    def close(connection):
+        """Close and forget a connection"""
+        if connection[1] is not None:
+            connection[1].close()
+        connection[0] = connection[1] = None
+    
+    def report(self, elapsed):
+        """Summarize per-endpoint throughput, errors and latency percentiles"""
+        endpoints = {}
+        for name, stats in self.stats.items():
+            latencies = stats['latencies']
+            requests = len(latencies) + sum(count for key, count in stats['statuses'].items()
+                                            if not key.isdigit())
+            if not requests:
+                continue
+            endpoints[name] = {
+                'requests': requests,
+                'errors': stats['errors'],
+                'error_rate': stats['errors'] / requests,
+                'requests_per_sec': requests / elapsed,
+                'bytes_per_sec': stats['bytes'] / elapsed,
+                'latency_ms': {
+                    'p50': percentile(latencies, 50) * 1000,
+                    'p90': percentile(latencies, 90) * 1000,
+                    'p99': percentile(latencies, 99) * 1000,
+                    'max': max(latencies, default=0) * 1000
+                },
+                'statuses': stats['statuses']
+            }
+            print(f"   {name:<10} {requests / elapsed:7.1f} req/s  "
+                  f"errors {stats['errors'] / requests:6.1%}  "
+                  f"p50 {endpoints[name]['latency_ms']['p50']:7.1f} ms  "
+                  f"p99 {endpoints[name]['latency_ms']['p99']:7.1f} ms")
+        
+        return {
+            'version': VERSION,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'target': f"{self.host}:{self.port}",
+            'viewers': self.viewers,
+            'duration': elapsed,
+            'endpoints': endpoints
+        }
+
+def control_station(path, action):
+    """Run a status/stop/drain action against a running station; returns the exit code"""
+    try:
+        reply = control_request(path, action)
+    except (OSError, ValueError) as e:
+        print(f"❌ No station answering on {path}: {e}")
+        return 1
+    
+    if not reply.get('ok'):
+        print(f"❌ {reply.get('error')}")
+        return 1
+    if action == 'stop':
+        print("🛑 Station is stopping")
+        return 0
+    
+    state = 'draining' if reply['draining'] else 'running'
+    print(f"🎮 Station {state} (pid {reply['pid']}, up {reply['uptime']}s, "
+          f"web port {reply['web_port']}, {reply['connections']} connections)")
+    print(f"📱 Sessions {len(reply['sessions'])}/{reply['max_sessions']}, "
+          f"{reply['devices']} devices seen, {len(reply['queue'])} queued")
+    for session in reply['sessions']:
+        controller = f", controlled by {session['controller']}" if session['controller'] else ''
+        print(f"   #{session['id']} {session['device']}: {session['remaining']}s left{controller}")
+    for position, description in enumerate(reply['queue'], 1):
+        print(f"   ⏳ {position}. {description}")
+    return 0
 
 def main():
     parser = argparse.ArgumentParser(description='VirtualHere USB Testing Station with Web Interface')
-    parser.add_argument('--program', required=True,
-                       help='Path to your testing program')
+    parser.add_argument('--program',
+                       help='Path to your testing program (required to start)')
     parser.add_argument('--server', default='localhost',
                        help='VirtualHere server host (default: localhost)')
     parser.add_argument('--port', type=int, default=7575,
                        help='VirtualHere server port (default: 7575)')
+    parser.add_argument('--hub', action='append', default=[], metavar='HOST:PORT',
+                       help='VirtualHere endpoint to pool; repeat for several hubs '
+                            '(replaces --server/--port)')
+    parser.add_argument('--max-sessions', type=int, default=1,
+                       help='Devices that can be in a test session at the same time (default: 1)')
+    parser.add_argument('--session-length', type=float, default=60,
+                       help='Seconds each device session lasts (default: 60)')
+    parser.add_argument('--upload-dir', default=UPLOAD_DIR,
+                       help=f'Where uploaded builds are stored (default: {UPLOAD_DIR})')
+    parser.add_argument('--build-cache-gb', type=float, default=20,
+                       help='Disk space for cached uploaded builds before the oldest are evicted (default: 20)')
     parser.add_argument('--web-port', type=int, default=8080,
                        help='Web server port (default: 8080)')
-    parser.add_argument('--action', choices=['start', 'stop', 'status', 'install-only'],
+    parser.add_argument('--action', choices=['start', 'stop', 'status', 'drain', 'install-only',
+                                             'benchmark', 'loadtest'],
                        default='start',
                        help='Action to perform')
+    parser.add_argument('--control-socket', default=CONTROL_SOCKET,
+                       help=f'Unix socket for status/stop/drain of a running station (default: {CONTROL_SOCKET})')
     parser.add_argument('--no-auto-install', action='store_true',
                        help='Skip automatic VirtualHere installation')
+    parser.add_argument('--vh-mirror',
+                       help='Base URL to download the VirtualHere client from instead of virtualhere.com')
+    parser.add_argument('--vh-cache-dir',
+                       help='Shared directory of verified VirtualHere client downloads '
+                            '(only filled when the SHA-256 is known from --vh-sha256 or the mirror)')
+    parser.add_argument('--vh-sha256',
+                       help='Expected SHA-256 of the VirtualHere client binary')
+    parser.add_argument('--capture-fps', type=float, default=15,
+                       help='Screen capture and stream rate in frames per second (default: 15)')
+    parser.add_argument('--encode-threads', type=int, default=None,
+                       help='Threads for strip-parallel resize/encode (default: CPU count, 1 = serial)')
+    parser.add_argument('--bench-resolutions', default='1080p,1440p,5k',
+                       help='Benchmark: comma-separated synthetic resolutions (1080p, 1440p, 5k)')
+    parser.add_argument('--bench-threads', default='1,0',
+                       help='Benchmark: comma-separated encode thread counts, 0 = CPU count')
+    parser.add_argument('--bench-viewers', default='1,10',
+                       help='Benchmark: comma-separated concurrent viewer counts')
+    parser.add_argument('--bench-seconds', type=float, default=5,
+                       help='Benchmark: seconds per measurement (default: 5)')
+    parser.add_argument('--bench-frames',
+                       help='Benchmark: directory of recorded screenshots to include')
+    parser.add_argument('--bench-output',
+                       help='Benchmark: write the JSON report to this file instead of stdout')
+    parser.add_argument('--load-target',
+                       help='Load test: station URL (default: http://localhost:<web-port>)')
+    parser.add_argument('--load-viewers', type=int, default=10,
+                       help='Load test: number of simulated viewers (default: 10)')
+    parser.add_argument('--load-duration', type=float, default=30,
+                       help='Load test: duration in seconds (default: 30)')
+    parser.add_argument('--load-input-interval', type=float, default=3.0,
+                       help='Load test: mean seconds between random clicks/keys per viewer, 0 = none')
+    parser.add_argument('--load-output',
+                       help='Load test: write the JSON report to this file instead of stdout')
     
     args = parser.parse_args()
     
+    # Control actions talk to the running station and need none of the heavy imports
+    if args.action in ('status', 'stop', 'drain'):
+        sys.exit(control_station(args.control_socket, args.action))
+    
     # Check for required dependencies
     try:
-        import pyautogui
-        from PIL import Image, ImageGrab
+        load_dependencies()
     except ImportError as e:
-        print(f"❌ Missing required dependency: {e}")
+        print(f"❌ Missing required dependency: {e.name}")
+        print("💡 Install with: pip3 install pyautogui pillow")
+        sys.exit(1)
+    
+    if args.action == 'start' and pyautogui is None:
+        print("❌ Missing required dependency: pyautogui (or no display available)")
         print("💡 Install with: pip3 install pyautogui pillow")
         sys.exit(1)
     
     # Validate program
-    if args.action != 'install-only' and not os.path.exists(args.program):
+    if args.action not in ('install-only', 'benchmark', 'loadtest') and \
+            (not args.program or not os.path.exists(args.program)):
         print(f"❌ Program not found: {args.program}")
         sys.exit(1)
     
     auto_install = not args.no_auto_install
     
+    hubs = []
+    for hub in args.hub:
+        host, _, port = hub.rpartition(':')
+        if not host or not port.isdigit():
+            print(f"❌ Invalid --hub {hub!r}, expected HOST:PORT")
+            sys.exit(1)
+        hubs.append((host, int(port)))
+    
+    if args.action == 'benchmark':
+        benchmark = PipelineBenchmark(
+            resolutions=[name.strip().lower() for name in args.bench_resolutions.split(',') if name.strip()],
+            threads=[int(value) for value in args.bench_threads.split(',')],
+            viewers=[int(value) for value in args.bench_viewers.split(',')],
+            seconds=args.bench_seconds,
+            fps=args.capture_fps,
+            recorded_dir=args.bench_frames
+        )
+        report = json.dumps(benchmark.run(), indent=2)
+        if args.bench_output:
+            with open(args.bench_output, 'w') as f:
+                f.write(report + "\n")
+            print(f"📊 Benchmark report written to {args.bench_output}")
+        else:
+            print(report)
+        return
+    
+    if args.action == 'loadtest':
+        generator = LoadGenerator(
+            args.load_target or f"http://localhost:{args.web_port}",
+            viewers=args.load_viewers,
+            duration=args.load_duration,
+            input_interval=args.load_input_interval
+        )
+        report = json.dumps(generator.run(), indent=2)
+        if args.load_output:
+            with open(args.load_output, 'w') as f:
+                f.write(report + "\n")
+            print(f"📊 Load test report written to {args.load_output}")
+        else:
+            print(report)
+        return
+    
     if args.action == 'install-only':
         print("📦 Installing VirtualHere client only...")
-        installer = VirtualHereInstaller()
+        installer = VirtualHereInstaller(args.vh_mirror, args.vh_cache_dir, args.vh_sha256)
         if installer.install():
             print("✅ VirtualHere client installed successfully")
             print(f"📍 Location: {installer.client_path}")
@@ -1267,7 +5524,10 @@ def main():
         return
     
     print(f"🎯 Program: {args.program}")
-    print(f"🌐 VirtualHere: {args.server}:{args.port}")
+    if hubs:
+        print(f"🌐 VirtualHere: {', '.join(args.hub)}")
+    else:
+        print(f"🌐 VirtualHere: {args.server}:{args.port}")
     print(f"🌐 Web Interface: http://localhost:{args.web_port}")
     print(f"📦 Auto-install: {'Yes' if auto_install else 'No'}")
     
@@ -1276,7 +5536,18 @@ def main():
         args.server, 
         args.port, 
         args.web_port,
-        auto_install
+        auto_install,
+        capture_fps=args.capture_fps,
+        encode_threads=args.encode_threads,
+        hubs=hubs,
+        max_sessions=args.max_sessions,
+        session_length=args.session_length,
+        upload_dir=args.upload_dir,
+        build_cache_gb=args.build_cache_gb,
+        vh_mirror=args.vh_mirror,
+        vh_cache_dir=args.vh_cache_dir,
+        vh_sha256=args.vh_sha256,
+        control_socket=args.control_socket
     )
     
     if args.action == 'start':
@@ -1291,12 +5562,15 @@ def main():
                 print("⌨️  Commands: Ctrl+C to stop")
                 print("="*60)
                 
-                while station.is_running:
+                # Stopped from the control socket or by draining, or Ctrl+C
+                while not station.stopped.is_set():
                     time.sleep(1)
                         
             except KeyboardInterrupt:
                 print("\n🛑 Stopping...")
                 station.stop()
+        else:
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()